@@ -0,0 +1,39 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом.
+
+    Первый вызов запускает задачу, остальные ждут ее же результат. Задача защищена
+    от отмены: если первый клиент отключится, остальные все равно получат ответ.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        return await asyncio.shield(self.start(key, func, *args))
+
+    def start(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> asyncio.Task:
+        """Запускает задачу в фоне, не дожидаясь результата; уже идущая задача не дублируется"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Результат забирают ожидающие вызовы; если их не осталось, не оставляем
+        # исключение незамеченным
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def tasks(self) -> List[asyncio.Task]:
+        return list(self._tasks.values())
@@ -0,0 +1,47 @@
+import codecs
+import zlib
+from typing import Iterator, Optional
+
+# Текст документов хорошо сжимается: русский текст в UTF-8 занимает два байта на букву
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(value: Optional[str]) -> Optional[bytes]:
+    if value is None:
+        return None
+    return zlib.compress(value.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress_text(value: Optional[bytes]) -> Optional[str]:
+    if value is None:
+        return None
+    return zlib.decompress(value).decode('utf-8')
+
+
+def iter_decompressed_text(value: bytes, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Распаковывает текст кусками не больше chunk_size байт, не собирая его целиком в памяти"""
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    data = value
+    while data:
+        text = decoder.decode(decompressor.decompress(data, chunk_size))
+        data = decompressor.unconsumed_tail
+        if text:
+            yield text
+    tail = decoder.decode(decompressor.flush(), final=True)
+    if tail:
+        yield tail
+
+
+def decompress_text_range(value: bytes, start: int, end: int, chunk_size: int = 64 * 1024) -> str:
+    """Символы [start, end) сжатого текста; распаковка останавливается на end"""
+    parts = []
+    offset = 0
+    for chunk in iter_decompressed_text(value, chunk_size):
+        chunk_end = offset + len(chunk)
+        if chunk_end > start:
+            parts.append(chunk[max(0, start - offset):end - offset])
+        offset = chunk_end
+        if offset >= end:
+            break
+    return ''.join(parts)
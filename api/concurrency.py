@@ -0,0 +1,360 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import UPSTREAM_RESPONSES, upstream_trace
+
+
+# Ответы, после которых запрос стоит повторить: перегрузка и временные ошибки сервера
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Повторять можно только запросы без побочных эффектов
+RETRY_METHODS = frozenset({'GET', 'HEAD'})
+
+STAT_KEYS = ('requests', 'retries', 'throttled', 'server_errors', 'network_errors', 'gave_up', 'wait_seconds')
+
+
+class UpstreamError(Exception):
+    """Сайт недоступен или отвечает ошибкой даже после повторов.
+
+    Такой результат нельзя считать пустым: его не сохраняют и не кэшируют.
+    """
+
+
+def is_upstream_failure(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Пауза из заголовка Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class _HostSlots:
+    """Счетчик одновременных запросов к хосту, общий для потоков и задач asyncio.
+
+    Освободившийся слот передается первому в очереди ожидающему - потоку или задаче
+    любого цикла событий, поэтому вместе их никогда не больше limit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+        # threading.Event ожидающего потока или (цикл событий, asyncio.Future) ожидающей задачи
+        self._waiters: deque = deque()
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        # Слот уже засчитан тем, кто его передал
+        event.wait()
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # Отмена пришла, когда слот уже передан задаче: отдаем его следующему
+            self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                    return
+                except RuntimeError:
+                    # Цикл событий задачи уже закрыт, слот достается следующему
+                    continue
+            self.active -= 1
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class HostBudget:
+    """Бюджет вежливости для каждого хоста: не больше max_concurrent одновременных
+    запросов и ограничение частоты по алгоритму token bucket.
+
+    Токены пополняются по одному в min_interval секунд, в запасе не больше burst
+    (burst=1 - ровно один запрос в min_interval). Работает и из потоков (slot),
+    и из задач asyncio (aslot); токены и слоты общие для обоих способов.
+
+    Неудачные запросы (429, 5xx, таймауты) повторяются до retries раз с экспоненциальной
+    паузой от backoff до max_backoff секунд со случайным разбросом. Retry-After
+    соблюдается и останавливает все запросы к хосту на указанное время.
+    """
+
+    def __init__(self, max_concurrent: int = 4, min_interval: float = 0.2, burst: int = 1,
+                 retries: int = 3, backoff: float = 0.5, max_backoff: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # Для каждого хоста: число токенов и момент, к которому оно относится
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._slots: Dict[str, _HostSlots] = {}
+
+    def _reserve(self, host: str) -> float:
+        """Берет токен для запроса к хосту и возвращает паузу до момента, когда он появится.
+
+        Токены можно брать в долг: очередь ожидающих упорядочена временем резервирования.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.min_interval > 0:
+                tokens, updated = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) / self.min_interval) - 1
+                self._buckets[host] = (tokens, now)
+                delay = -tokens * self.min_interval if tokens < 0 else 0.0
+            else:
+                delay = 0.0
+            delay = max(delay, self._paused_until.get(host, now) - now)
+
+            stats = self._host_stats(host)
+            stats['requests'] += 1
+            stats['wait_seconds'] += delay
+            return delay
+
+    def _host_stats(self, host: str) -> Dict[str, float]:
+        if host not in self._stats:
+            self._stats[host] = dict.fromkeys(STAT_KEYS, 0)
+        return self._stats[host]
+
+    def pause(self, host: str, seconds: float) -> None:
+        """Откладывает все новые запросы к хосту на seconds секунд"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused_until[host] = max(until, self._paused_until.get(host, until))
+
+    def retry_delay(self, url: str, attempt: int, status_code: Optional[int] = None,
+                    retry_after: Optional[str] = None) -> Optional[float]:
+        """Пауза перед повтором неудачной попытки attempt (с нуля) или None, если повторять не нужно.
+
+        status_code=None означает сетевую ошибку или таймаут.
+        """
+        host = urlparse(url).netloc
+        requested = parse_retry_after(retry_after)
+        delay = requested if requested is not None else self._backoff(attempt)
+        if requested is not None or status_code == 429:
+            # Сайт просит сбавить темп: притормаживаем все запросы к хосту, а не только этот
+            self.pause(host, delay)
+
+        with self._lock:
+            stats = self._host_stats(host)
+            if status_code is None:
+                stats['network_errors'] += 1
+            elif status_code == 429:
+                stats['throttled'] += 1
+            else:
+                stats['server_errors'] += 1
+
+            # Слишком долгую паузу внутри запроса не ждем, но хост остается приостановленным
+            if attempt >= self.retries or delay > self.max_backoff:
+                stats['gave_up'] += 1
+                return None
+            stats['retries'] += 1
+        return delay
+
+    def _backoff(self, attempt: int) -> float:
+        # Половина паузы фиксирована, половина случайна, чтобы повторы разных клиентов не совпадали
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Счетчики по хостам: запросы, повторы, 429, 5xx, сетевые ошибки, отказы и суммарное ожидание"""
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._stats.items()}
+
+    def _host_slots(self, host: str) -> _HostSlots:
+        with self._lock:
+            return self._slots.setdefault(host, _HostSlots(self.max_concurrent))
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        host = urlparse(url).netloc
+        slots = self._host_slots(host)
+        slots.acquire()
+        try:
+            delay = self._reserve(host)
+            if delay > 0:
+                time.sleep(delay)
+            yield
+        finally:
+            slots.release()
+
+    @asynccontextmanager
+    async def aslot(self, url: str) -> AsyncIterator[None]:
+        host = urlparse(url).netloc
+        slots = self._host_slots(host)
+        await slots.aacquire()
+        try:
+            delay = self._reserve(host)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            slots.release()
+
+
+# Общий бюджет процесса: его делят все скраперы, если им не передан свой
+default_budget = HostBudget()
+
+
+class PoliteAdapter(HTTPAdapter):
+    """Сетевой адаптер requests, который соблюдает бюджет вежливости хоста
+    и повторяет запросы после временных ошибок"""
+
+    def __init__(self, budget: HostBudget = default_budget, **kwargs):
+        super().__init__(**kwargs)
+        self.budget = budget
+
+    def send(self, request, **kwargs):
+        retryable = request.method in RETRY_METHODS
+        attempt = 0
+        while True:
+            # Пауза перед повтором выдерживается вне слота, чтобы не занимать его зря
+            with self.budget.slot(request.url):
+                try:
+                    response = super().send(request, **kwargs)
+                except (requests.Timeout, requests.ConnectionError):
+                    UPSTREAM_RESPONSES.inc('error')
+                    delay = self.budget.retry_delay(request.url, attempt) if retryable else None
+                    if delay is None:
+                        raise
+                else:
+                    UPSTREAM_RESPONSES.inc(str(response.status_code))
+                    if response.status_code not in RETRY_STATUSES or not retryable:
+                        return response
+                    delay = self.budget.retry_delay(
+                        request.url, attempt, response.status_code, response.headers.get('Retry-After')
+                    )
+                    if delay is None:
+                        return response
+                    response.close()
+            attempt += 1
+            time.sleep(delay)
+
+
+class PoliteTransport(httpx.AsyncBaseTransport):
+    """Транспорт httpx, который соблюдает бюджет вежливости хоста
+    и повторяет запросы после временных ошибок"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, budget: HostBudget = default_budget):
+        self.transport = transport
+        self.budget = budget
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        retryable = request.method in RETRY_METHODS
+        attempt = 0
+        while True:
+            # Время соединения, ожидания ответа и загрузки каждой попытки попадает в /metrics
+            request.extensions['trace'] = upstream_trace()
+            async with self.budget.aslot(url):
+                try:
+                    response = await self.transport.handle_async_request(request)
+                except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError):
+                    UPSTREAM_RESPONSES.inc('error')
+                    delay = self.budget.retry_delay(url, attempt) if retryable else None
+                    if delay is None:
+                        raise
+                else:
+                    UPSTREAM_RESPONSES.inc(str(response.status_code))
+                    if response.status_code not in RETRY_STATUSES or not retryable:
+                        return response
+                    delay = self.budget.retry_delay(
+                        url, attempt, response.status_code, response.headers.get('Retry-After')
+                    )
+                    if delay is None:
+                        return response
+                    await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def iter_completed(func: Callable[[Any], Any], items: Iterable, concurrency: int) -> Iterator[Any]:
+    """Выполняет func для элементов в пуле из concurrency потоков и отдает результаты
+    по мере готовности. При досрочном закрытии генератора еще не начатые вызовы отменяются.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = [executor.submit(func, item) for item in items]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_completed(func: Callable[[Any], Awaitable[Any]], items: Iterable,
+                          concurrency: int) -> AsyncIterator[Any]:
+    """Асинхронный аналог iter_completed: не больше concurrency корутин одновременно,
+    результаты по мере готовности, при досрочном закрытии оставшиеся задачи отменяются.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    tasks = [asyncio.ensure_future(run(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from .database import run_db, CrawlFrontierDB, DocumentDB
+from .scraper import AsyncMeganormScraper
+from . import store
+
+logger = logging.getLogger(__name__)
+
+# Интервалы повторного обхода по видам страниц
+DEFAULT_INTERVALS = {
+    'types': timedelta(days=1),
+    'listing': timedelta(hours=6),
+    'document': timedelta(days=7),
+}
+# Пауза перед повтором после неудачи удваивается, но не превышает MAX_RETRY_DELAY
+RETRY_DELAY = timedelta(minutes=5)
+MAX_RETRY_DELAY = timedelta(days=1)
+
+
+class Crawler:
+    """Фоновый инкрементальный обход meganorm.ru в локальное хранилище.
+
+    Очередь страниц хранится в таблице crawl_frontier, поэтому после перезапуска
+    обход продолжается с того же места. Каждой странице назначается время следующего
+    обхода: новые документы обходятся сразу, уже сохраненные - по мере устаревания
+    их last_updated, первые страницы списков - чаще дальних.
+
+    Методы работы с очередью принимают сессию первым аргументом и выполняются
+    в пуле потоков БД через run_db, не блокируя цикл событий.
+    """
+
+    def __init__(self, scraper: AsyncMeganormScraper, concurrency: int = 4,
+                 intervals: Optional[Dict[str, timedelta]] = None, max_pages: int = 100,
+                 idle_sleep: float = 30.0):
+        self.scraper = scraper
+        self.concurrency = concurrency
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.max_pages = max_pages
+        self.idle_sleep = idle_sleep
+        self.stats = {'crawled': 0, 'failed': 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def run(self) -> None:
+        await self._seed()
+        while True:
+            try:
+                items = await run_db(self._due, self.concurrency)
+                if not items:
+                    await asyncio.sleep(self.idle_sleep)
+                    continue
+                await asyncio.gather(*(self._crawl(item) for item in items))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка фонового обхода: {e}")
+                await asyncio.sleep(self.idle_sleep)
+
+    async def _seed(self) -> None:
+        """Добавляет в очередь страницу типов документов, если ее там еще нет"""
+        await run_db(self._enqueue, [{'url': self.scraper.types_url, 'kind': 'types'}])
+
+    def _due(self, db: Session, limit: int) -> List[CrawlFrontierDB]:
+        items = (
+            db.query(CrawlFrontierDB)
+            .filter(CrawlFrontierDB.next_crawl_at <= datetime.utcnow())
+            .order_by(CrawlFrontierDB.next_crawl_at)
+            .limit(limit)
+            .all()
+        )
+        db.expunge_all()
+        return items
+
+    def _enqueue(self, db: Session, entries: List[Dict]) -> None:
+        """Добавляет страницы в очередь; уже известные URL не меняются"""
+        if not entries:
+            return
+        now = datetime.utcnow()
+        rows = [dict({'next_crawl_at': now, 'failures': 0, 'page': 0}, **entry) for entry in entries]
+        db.execute(insert(CrawlFrontierDB).values(rows).on_conflict_do_nothing(index_elements=['url']))
+        db.commit()
+
+    def _enqueue_documents(self, db: Session, doc_type: str, documents_data: List[Dict]) -> None:
+        """Ставит документы в очередь с учетом давности уже сохраненного содержимого"""
+        urls = [doc_data['url'] for doc_data in documents_data]
+        stored = dict(
+            db.query(DocumentDB.url, DocumentDB.last_updated)
+            .filter(DocumentDB.url.in_(urls), DocumentDB.body.has())
+        )
+
+        now = datetime.utcnow()
+        self._enqueue(db, [
+            {
+                'url': url,
+                'kind': 'document',
+                'doc_type': doc_type,
+                # Документ без содержимого обходится сразу, сохраненный - когда устареет
+                'next_crawl_at': stored[url] + self.intervals['document'] if url in stored else now,
+            }
+            for url in urls
+        ])
+
+    def _reschedule(self, db: Session, item: CrawlFrontierDB, ok: bool) -> None:
+        now = datetime.utcnow()
+        db_item = db.get(CrawlFrontierDB, item.id)
+        if ok:
+            interval = self.intervals[item.kind]
+            if item.kind == 'listing':
+                # Новые документы появляются на первых страницах списка
+                interval *= item.page + 1
+            db_item.failures = 0
+            db_item.last_crawled = now
+            db_item.next_crawl_at = now + interval
+        else:
+            db_item.failures = (db_item.failures or 0) + 1
+            db_item.next_crawl_at = now + min(RETRY_DELAY * 2 ** (db_item.failures - 1), MAX_RETRY_DELAY)
+        db.commit()
+
+    async def _crawl(self, item: CrawlFrontierDB) -> None:
+        try:
+            if item.kind == 'types':
+                ok = await self._crawl_types()
+            elif item.kind == 'listing':
+                ok = await self._crawl_listing(item)
+            else:
+                ok = await self._crawl_document(item)
+        except Exception as e:
+            logger.error(f"Ошибка обхода {item.url}: {e}")
+            ok = False
+
+        self.stats['crawled' if ok else 'failed'] += 1
+        await run_db(self._reschedule, item, ok)
+
+    async def _crawl_types(self) -> bool:
+        types_data = await self.scraper.get_document_types()
+        if not types_data:
+            return False
+
+        await run_db(store.save_document_types, types_data)
+
+        await run_db(self._enqueue, [
+            {
+                'url': self.scraper.listing_url(type_data['url'], 0),
+                'kind': 'listing',
+                'doc_type': type_data['name'],
+                'type_url': type_data['url'],
+                'page': 0,
+            }
+            for type_data in types_data
+        ])
+        return True
+
+    async def _crawl_listing(self, item: CrawlFrontierDB) -> bool:
+        documents_data = await self.scraper.get_documents_by_type(item.type_url, item.page)
+        if not documents_data:
+            # Пустая первая страница - ошибка, пустая дальняя - конец списка
+            return item.page > 0
+
+        await run_db(store.save_listing, item.doc_type, documents_data)
+        await run_db(self._enqueue_documents, item.doc_type, documents_data)
+
+        next_page = item.page + 1
+        if next_page < self.max_pages:
+            await run_db(self._enqueue, [{
+                'url': self.scraper.listing_url(item.type_url, next_page),
+                'kind': 'listing',
+                'doc_type': item.doc_type,
+                'type_url': item.type_url,
+                'page': next_page,
+            }])
+        return True
+
+    def _is_stored(self, db: Session, url: str) -> bool:
+        """Есть ли у документа сохраненное содержимое"""
+        return db.query(DocumentDB.url).filter(DocumentDB.url == url, DocumentDB.body.has()).first() is not None
+
+    async def _crawl_document(self, item: CrawlFrontierDB) -> bool:
+        # Сохраненный документ обходится повторно, когда устарел: свежая копия HTTP-кэша его не обновит
+        revalidate = await run_db(self._is_stored, item.url)
+        content_data = await self.scraper.get_document_content(item.url, revalidate=revalidate)
+        if not content_data['content']:
+            return False
+
+        await run_db(store.save_document_content, item.url, content_data)
+        return True
+
+    def get_status(self, db: Session) -> Dict:
+        queued = dict(
+            db.query(CrawlFrontierDB.kind, func.count(CrawlFrontierDB.id))
+            .group_by(CrawlFrontierDB.kind)
+        )
+        due = (
+            db.query(func.count(CrawlFrontierDB.id))
+            .filter(CrawlFrontierDB.next_crawl_at <= datetime.utcnow())
+            .scalar()
+        )
+        return {'running': self.running, 'queued': queued, 'due': due, **self.stats}
@@ -1,7 +1,22 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, Date, ForeignKey, Integer, LargeBinary, String, Text, DateTime
+)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Callable, Optional
+import asyncio
+import os
+import time
+from .compression import compress_text, decompress_text
+from .metrics import STAGE_SECONDS
+from .normalize import document_fields
+from .search import create_search_index, drop_text_indexes, register_sql_functions, stem_text
+
+# Длина начала текста, которое хранится рядом с документом для списков и поиска
+SUMMARY_LENGTH = 200
 
 Base = declarative_base()
 
@@ -14,6 +29,8 @@ class DocumentTypeDB(Base):
     url = Column(String)
     count = Column(Integer, default=0)
     last_updated = Column(DateTime, default=datetime.utcnow)
+    # Номер последнего изменения строки для инкрементальной выгрузки (CHANGE_TRIGGERS_DDL)
+    change_seq = Column(Integer, index=True)
 
 
 class DocumentDB(Base):
@@ -25,23 +42,305 @@ class DocumentDB(Base):
     doc_type = Column(String, index=True)
     date_published = Column(String)
     number = Column(String)
-    content = Column(Text)
+    # Нормализованные дата и номер для фильтров /search (api.normalize.document_fields):
+    # дата принятия, обозначение (ГОСТ Р, СП, ФЗ...) и номер без него
+    published_on = Column(Date, index=True)
+    number_prefix = Column(String)
+    number_key = Column(String, index=True)
+    summary = Column(String)  # начало текста для списков и результатов поиска
     sections = Column(Text)  # JSON string
+    # Время загрузки текста с сайта: по нему считается свежесть документа
     last_updated = Column(DateTime, default=datetime.utcnow)
+    # Номер последнего изменения строки, в том числе дополнения полей со страницы списка;
+    # по нему идет инкрементальная выгрузка (api.export)
+    change_seq = Column(Integer, index=True)
+
+    # Сжатый текст лежит в отдельной таблице и читается только при обращении к content
+    body = relationship("DocumentContentDB", uselist=False, cascade="all, delete-orphan")
+    # Оглавление с границами разделов в тексте
+    outline = relationship("DocumentSectionDB", order_by="DocumentSectionDB.position",
+                           cascade="all, delete-orphan")
+
+    @property
+    def content(self) -> Optional[str]:
+        return decompress_text(self.body.content_z) if self.body else None
+
+    @content.setter
+    def content(self, value: Optional[str]):
+        self.summary = make_summary(value)
+        if value is None:
+            self.body = None
+            return
+        # Основы слов считаются здесь, до записи в БД, а не в триггере индекса
+        content_z, stem_z = compress_text(value), compress_text(stem_text(value))
+        if self.body:
+            self.body.content_z, self.body.stem_z = content_z, stem_z
+        else:
+            self.body = DocumentContentDB(content_z=content_z, stem_z=stem_z)
+
+
+class DocumentContentDB(Base):
+    """Текст документа, сжатый zlib"""
+    __tablename__ = "document_contents"
+
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    content_z = Column(LargeBinary)
+    # Текст из основ слов для индекса documents_stem (api.search.stem_text), тоже сжатый
+    stem_z = Column(LargeBinary)
+
+
+class DocumentSectionDB(Base):
+    """Раздел документа: заголовок, уровень и границы [start, end) в символах текста.
+
+    Раздел 0 - весь документ, parent - номер объемлющего раздела.
+    """
+    __tablename__ = "document_sections"
+
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    parent = Column(Integer)
+    level = Column(Integer)
+    heading = Column(String)
+    start = Column(Integer)
+    end = Column(Integer)
+
+
+class CrawlFrontierDB(Base):
+    """Очередь фонового обхода сайта: страница типов, страницы списков и документы"""
+    __tablename__ = "crawl_frontier"
+
+    id = Column(Integer, primary_key=True, index=True)
+    url = Column(String, unique=True)
+    kind = Column(String, index=True)  # types, listing или document
+    doc_type = Column(String)
+    type_url = Column(String)
+    page = Column(Integer, default=0)
+    next_crawl_at = Column(DateTime, index=True, default=datetime.utcnow)
+    last_crawled = Column(DateTime)
+    failures = Column(Integer, default=0)
 
 
+# Запросы к БД из асинхронного кода выполняются в отдельном пуле потоков; на каждый поток
+# приходится свое соединение, поэтому размер пула соединений совпадает с числом потоков
+DB_THREADS = int(os.getenv("MEGANORM_DB_THREADS", "4"))
+
 # Создание базы данных
-engine = create_engine("sqlite:///./meganorm.db")
+engine = create_engine(os.getenv("MEGANORM_DATABASE_URL", "sqlite:///./meganorm.db"), pool_size=DB_THREADS)
+# SQL-функции нужны триггерам поисковых индексов на каждом соединении
+event.listen(engine, "connect", register_sql_functions)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Номера изменений строк для инкрементальной выгрузки. Номер - максимум по таблице плюс
+# один - присваивает триггер, то есть под блокировкой записи SQLite: строка, измененная
+# позже, всегда получает номер больше, чем у всех строк, которые уже видны читателю.
+# Время, взятое в Python до записи, таким свойством не обладает.
+CHANGE_TABLES = ('documents', 'document_types')
+CHANGE_TRIGGERS_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_change_ai AFTER INSERT ON {table} BEGIN
+        UPDATE {table} SET change_seq = coalesce((SELECT max(change_seq) FROM {table}), 0) + 1
+        WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_change_au AFTER UPDATE ON {table}
+    WHEN new.change_seq IS old.change_seq BEGIN
+        UPDATE {table} SET change_seq = coalesce((SELECT max(change_seq) FROM {table}), 0) + 1
+        WHERE id = new.id;
+    END
+    """,
+]
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='meganorm-db')
+
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Режим SQLite для одновременной работы: читатели не ждут писателя (WAL),
+    занятая БД ожидается до busy_timeout мс, а не сразу дает ошибку"""
+    if engine.dialect.name != 'sqlite':
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('MEGANORM_SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+    # В режиме WAL NORMAL не теряет целостность при сбое, а fsync делается только на контрольных точках
+    cursor.execute(f"PRAGMA synchronous={os.getenv('MEGANORM_SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.close()
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет func(db, *args, **kwargs) в пуле потоков БД с отдельной сессией,
+    не блокируя цикл событий"""
+    def call():
+        with SessionLocal() as db:
+            return func(db, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
+
+
+# Время каждого запроса к БД попадает в /metrics как этап db_read или db_write
+@event.listens_for(engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None:
+        read = statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'PRAGMA')
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'db_read' if read else 'db_write')
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+def make_summary(content: Optional[str]) -> Optional[str]:
+    if content is None:
+        return None
+    return content[:SUMMARY_LENGTH] + "..." if len(content) > SUMMARY_LENGTH else content
+
+
+def _migrate_documents(engine, batch_size: int = 100):
+    """Переносит текст из старой колонки documents.content в document_contents.
+
+    Индексы по тексту пересоздаются create_search_index поверх новой схемы.
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns('documents')}
+    if 'content' not in columns or 'summary' in columns:
+        return
+
+    with engine.begin() as conn:
+        drop_text_indexes(conn)
+        conn.execute(text("ALTER TABLE documents ADD COLUMN summary VARCHAR"))
+
+        last_id = 0
+        while True:
+            rows = conn.execute(text("""
+                SELECT id, content FROM documents
+                WHERE id > :last_id AND content IS NOT NULL
+                ORDER BY id LIMIT :limit
+            """), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+
+            for doc_id, content in rows:
+                conn.execute(
+                    text("""
+                        INSERT OR REPLACE INTO document_contents(document_id, content_z, stem_z)
+                        VALUES (:id, :content_z, :stem_z)
+                    """),
+                    {'id': doc_id, 'content_z': compress_text(content), 'stem_z': compress_text(stem_text(content))}
+                )
+                conn.execute(
+                    text("UPDATE documents SET summary = :summary WHERE id = :id"),
+                    {'id': doc_id, 'summary': make_summary(content)}
+                )
+            last_id = rows[-1][0]
+
+        try:
+            conn.execute(text("ALTER TABLE documents DROP COLUMN content"))
+        except OperationalError:
+            # SQLite до 3.35 не умеет удалять колонки - просто освобождаем место
+            conn.execute(text("UPDATE documents SET content = NULL"))
+
+
+def _migrate_document_fields(engine, batch_size: int = 500):
+    """Добавляет колонки published_on, number_prefix и number_key и заполняет их
+    для сохраненных документов по строковым дате, номеру и заголовку"""
+    columns = {column['name'] for column in inspect(engine).get_columns('documents')}
+    if 'number_key' in columns:
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN published_on DATE"))
+        conn.execute(text("ALTER TABLE documents ADD COLUMN number_prefix VARCHAR"))
+        conn.execute(text("ALTER TABLE documents ADD COLUMN number_key VARCHAR"))
+
+        last_id = 0
+        while True:
+            rows = conn.execute(text("""
+                SELECT id, title, date_published, number FROM documents
+                WHERE id > :last_id
+                ORDER BY id LIMIT :limit
+            """), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+
+            updates = []
+            for doc_id, title, date_published, number in rows:
+                fields = document_fields(title, date_published, number)
+                published_on = fields['published_on']
+                updates.append(dict(fields, id=doc_id, published_on=published_on.isoformat() if published_on else None))
+            conn.execute(text("""
+                UPDATE documents
+                SET published_on = :published_on, number_prefix = :number_prefix, number_key = :number_key
+                WHERE id = :id
+            """), updates)
+            last_id = rows[-1][0]
+
+
+def _migrate_document_stems(engine, batch_size: int = 100):
+    """Добавляет колонку document_contents.stem_z и заполняет ее для сохраненных текстов.
+
+    Индекс documents_stem удаляется и строится заново create_search_index уже по stem_z.
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns('document_contents')}
+    if 'stem_z' in columns:
+        return
+
+    with engine.begin() as conn:
+        drop_text_indexes(conn, ('documents_stem',))
+        conn.execute(text("ALTER TABLE document_contents ADD COLUMN stem_z BLOB"))
+
+        last_id = 0
+        while True:
+            rows = conn.execute(text("""
+                SELECT document_id, content_z FROM document_contents
+                WHERE document_id > :last_id
+                ORDER BY document_id LIMIT :limit
+            """), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+
+            updates = [
+                {'id': doc_id, 'stem_z': compress_text(stem_text(decompress_text(content_z)))}
+                for doc_id, content_z in rows if content_z is not None
+            ]
+            if updates:
+                conn.execute(text("UPDATE document_contents SET stem_z = :stem_z WHERE document_id = :id"), updates)
+            last_id = rows[-1][0]
+
+
+def _migrate_change_seq(engine):
+    """Добавляет колонку change_seq и нумерует сохраненные строки по порядку id"""
+    with engine.begin() as conn:
+        for table in CHANGE_TABLES:
+            columns = {column['name'] for column in inspect(conn).get_columns(table)}
+            if 'change_seq' in columns:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN change_seq INTEGER"))
+            conn.execute(text(f"UPDATE {table} SET change_seq = id"))
+
+
+def _create_change_triggers(engine):
+    with engine.begin() as conn:
+        for table in CHANGE_TABLES:
+            for ddl in CHANGE_TRIGGERS_DDL:
+                conn.execute(text(ddl.format(table=table)))
+
+
+def _create_indexes(engine):
+    """Индексы, добавленные в модели после создания таблиц: create_all их не создает"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def create_tables():
+    Base.metadata.create_all(bind=engine)
+    _migrate_documents(engine)
+    _migrate_document_stems(engine)
+    _migrate_change_seq(engine)
+    _migrate_document_fields(engine)
+    _create_indexes(engine)
+    _create_change_triggers(engine)
+    create_search_index(engine)
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Выгрузка сохраненных документов и типов документов в NDJSON, сжатый gzip.
+
+Запуск из корня репозитория:
+    python -m api.export documents [--since 1234] [--state export.state]
+                                   [--out documents.ndjson.gz] [--no-content]
+
+Строки читаются из БД порциями (yield_per) и сразу сжимаются, поэтому память не растет
+с размером базы. Последняя строка {"type": "end"} содержит watermark - наибольший
+номер изменения (change_seq) выгруженных строк; передав его в --since (или храня в файле
+--state), следующая выгрузка получит только изменившиеся с тех пор строки. Номера
+присваивает SQLite при записи, поэтому строка, зафиксированная во время выгрузки,
+получит номер больше watermark и не будет пропущена.
+"""
+import argparse
+import json
+import os
+import sys
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+from sqlalchemy.orm import Session
+from .compression import decompress_text
+from .database import SessionLocal, DocumentContentDB, DocumentDB, DocumentTypeDB
+
+EXPORT_KINDS = ('documents', 'types')
+# Сколько строк читается из БД за один раз
+EXPORT_BATCH = 200
+# Сжатые данные отдаются кусками не меньше этого размера
+EXPORT_CHUNK = 64 * 1024
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _iter_documents(db: Session, since: Optional[int], content: bool) -> Iterator[Dict]:
+    columns = [
+        DocumentDB.id, DocumentDB.title, DocumentDB.url, DocumentDB.doc_type, DocumentDB.date_published,
+        DocumentDB.number, DocumentDB.published_on, DocumentDB.number_prefix, DocumentDB.number_key,
+        DocumentDB.sections, DocumentDB.last_updated, DocumentDB.change_seq,
+    ]
+    query = db.query(*columns, DocumentContentDB.content_z) if content else db.query(*columns)
+    if content:
+        query = query.outerjoin(DocumentContentDB, DocumentContentDB.document_id == DocumentDB.id)
+    if since is not None:
+        query = query.filter(DocumentDB.change_seq > since)
+
+    for row in query.order_by(DocumentDB.change_seq).yield_per(EXPORT_BATCH):
+        record = {
+            'type': 'document',
+            'id': row.id,
+            'title': row.title,
+            'url': row.url,
+            'doc_type': row.doc_type,
+            'date_published': row.date_published,
+            'number': row.number,
+            'published_on': row.published_on.isoformat() if row.published_on else None,
+            'number_prefix': row.number_prefix,
+            'number_key': row.number_key,
+            'sections': json.loads(row.sections) if row.sections else [],
+            'last_updated': _iso(row.last_updated),
+            'change_seq': row.change_seq,
+        }
+        if content:
+            record['content'] = decompress_text(row.content_z) if row.content_z else None
+        yield record
+
+
+def _iter_types(db: Session, since: Optional[int]) -> Iterator[Dict]:
+    query = db.query(
+        DocumentTypeDB.id, DocumentTypeDB.name, DocumentTypeDB.url, DocumentTypeDB.count,
+        DocumentTypeDB.last_updated, DocumentTypeDB.change_seq
+    )
+    if since is not None:
+        query = query.filter(DocumentTypeDB.change_seq > since)
+
+    for row in query.order_by(DocumentTypeDB.change_seq).yield_per(EXPORT_BATCH):
+        yield {
+            'type': 'document_type',
+            'id': row.id,
+            'name': row.name,
+            'url': row.url,
+            'count': row.count,
+            'last_updated': _iso(row.last_updated),
+            'change_seq': row.change_seq,
+        }
+
+
+def iter_export(db: Session, kind: str, since: Optional[int] = None, content: bool = True) -> Iterator[Dict]:
+    """Строки выгрузки kind (documents или types) с номером изменения больше since по
+    возрастанию номера и итоговая строка с их числом и новым watermark"""
+    rows = _iter_documents(db, since, content) if kind == 'documents' else _iter_types(db, since)
+    count, watermark = 0, since
+    for record in rows:
+        count += 1
+        if record['change_seq'] is not None:
+            watermark = record['change_seq']
+        yield record
+    yield {'type': 'end', 'count': count, 'watermark': watermark}
+
+
+def ndjson_lines(records: Iterable[Dict]) -> Iterator[bytes]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def gzip_chunks(data: Iterable[bytes], chunk_size: int = EXPORT_CHUNK) -> Iterator[bytes]:
+    """Сжимает поток байтов в формат gzip, не собирая его в памяти"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending, size = [], 0
+    for piece in data:
+        compressed = compressor.compress(piece)
+        if compressed:
+            pending.append(compressed)
+            size += len(compressed)
+        if size >= chunk_size:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def _read_state(path: str) -> Optional[int]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            value = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return int(value) if value else None
+
+
+def _write_state(path: str, watermark: Optional[int]) -> None:
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(('' if watermark is None else str(watermark)) + '\n')
+    os.replace(temporary, path)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=EXPORT_KINDS)
+    parser.add_argument('--since', type=int, help='выгрузить строки с номером изменения больше этого')
+    parser.add_argument('--state', help='файл с watermark: читается как --since и обновляется после выгрузки')
+    parser.add_argument('--out', help='файл .ndjson.gz; по умолчанию stdout')
+    parser.add_argument('--no-content', dest='content', action='store_false', help='без текста документов')
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if since is None and args.state:
+        since = _read_state(args.state)
+
+    summary = {}
+
+    def records(db: Session) -> Iterator[Dict]:
+        for record in iter_export(db, args.kind, since, args.content):
+            if record['type'] == 'end':
+                summary.update(record)
+            yield record
+
+    out = open(args.out, 'wb') if args.out else sys.stdout.buffer
+    try:
+        with SessionLocal() as db:
+            for chunk in gzip_chunks(ndjson_lines(records(db))):
+                out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+    # Watermark сохраняется только после успешной выгрузки, иначе строки будут пропущены
+    if args.state:
+        _write_state(args.state, summary['watermark'])
+    print(f"Выгружено строк: {summary['count']}, watermark: {summary['watermark']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
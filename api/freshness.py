@@ -0,0 +1,59 @@
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+FRESH = 'fresh'
+STALE = 'stale'
+EXPIRED = 'expired'
+
+DEFAULT_SOFT_TTL = timedelta(days=7)
+DEFAULT_HARD_TTL = timedelta(days=90)
+
+
+class FreshnessPolicy:
+    """Сроки свежести сохраненных документов по типам.
+
+    Документ моложе soft TTL свежий. Между soft и hard TTL он устарел: отдается сразу,
+    а обновление идет в фоне. Старше hard TTL документ перед ответом загружается заново.
+    """
+
+    def __init__(self, soft_ttl: timedelta = DEFAULT_SOFT_TTL, hard_ttl: timedelta = DEFAULT_HARD_TTL,
+                 per_type: Optional[Dict[str, Tuple[timedelta, timedelta]]] = None):
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.per_type = per_type or {}
+
+    @classmethod
+    def from_env(cls) -> 'FreshnessPolicy':
+        """Политика по настройкам окружения.
+
+        MEGANORM_SOFT_TTL и MEGANORM_HARD_TTL задают сроки в секундах для всех типов,
+        MEGANORM_FRESHNESS - JSON с исключениями: {"ГОСТ": {"soft": 86400, "hard": 604800}}.
+        """
+        soft_ttl = timedelta(seconds=float(os.getenv("MEGANORM_SOFT_TTL", DEFAULT_SOFT_TTL.total_seconds())))
+        hard_ttl = timedelta(seconds=float(os.getenv("MEGANORM_HARD_TTL", DEFAULT_HARD_TTL.total_seconds())))
+        per_type = {
+            doc_type: (
+                timedelta(seconds=ttls.get('soft', soft_ttl.total_seconds())),
+                timedelta(seconds=ttls.get('hard', hard_ttl.total_seconds())),
+            )
+            for doc_type, ttls in json.loads(os.getenv("MEGANORM_FRESHNESS") or "{}").items()
+        }
+        return cls(soft_ttl, hard_ttl, per_type)
+
+    def ttls(self, doc_type: Optional[str]) -> Tuple[timedelta, timedelta]:
+        return self.per_type.get(doc_type, (self.soft_ttl, self.hard_ttl))
+
+    def state(self, doc_type: Optional[str], last_updated: Optional[datetime],
+              now: Optional[datetime] = None) -> str:
+        """fresh, stale или expired для документа, сохраненного в last_updated"""
+        if last_updated is None:
+            return EXPIRED
+        soft_ttl, hard_ttl = self.ttls(doc_type)
+        age = (now or datetime.utcnow()) - last_updated
+        if age < soft_ttl:
+            return FRESH
+        if age < hard_ttl:
+            return STALE
+        return EXPIRED
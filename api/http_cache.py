@@ -0,0 +1,333 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Время жизни закэшированной страницы по классам URL (секунды).
+# По истечении срока страница перепроверяется условным запросом (If-None-Match / If-Modified-Since).
+DEFAULT_TTLS = {
+    'types': 24 * 3600,      # главная страница со списком типов документов
+    'listing': 3600,         # страницы списков документов
+    'document': 7 * 24 * 3600,  # тексты документов
+}
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+# Заголовки, которые сохраняются вместе с телом ответа
+STORED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+# Время доступа обновляется не чаще раза в минуту, чтобы попадания не превращались в запись на диск
+ACCESS_RESOLUTION = 60
+
+# Занятый размер хранится в отдельной строке и поддерживается триггерами, поэтому его
+# видят все процессы, а запись не пересчитывает сумму по всей таблице
+SIZE_TRIGGERS_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS http_cache_size_ai AFTER INSERT ON http_cache BEGIN
+        UPDATE http_cache_size SET total = total + new.size;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS http_cache_size_ad AFTER DELETE ON http_cache BEGIN
+        UPDATE http_cache_size SET total = total - old.size;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS http_cache_size_au AFTER UPDATE OF size ON http_cache BEGIN
+        UPDATE http_cache_size SET total = total - old.size + new.size;
+    END
+    """,
+]
+
+
+def requires_revalidation(headers) -> bool:
+    """Запрос с Cache-Control: no-cache не обслуживается из кэша без проверки на сайте,
+    даже если запись еще свежая; при 304 запись продлевается как обычно"""
+    return 'no-cache' in headers.get('cache-control', '').lower()
+
+
+class CacheEntry:
+    def __init__(self, url: str, body: bytes, headers: Dict[str, str], stored_at: float, accessed_at: float):
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.stored_at = stored_at
+        self.accessed_at = accessed_at
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.headers.get('etag')
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self.headers.get('last-modified')
+
+    def validators(self) -> Dict[str, str]:
+        """Заголовки условного запроса для перепроверки записи"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """Дисковый HTTP-кэш страниц meganorm.ru.
+
+    Тела ответов хранятся сжатыми в SQLite, при превышении max_size вытесняются
+    давно не использованные записи (LRU). Потокобезопасен; файл кэша могут делить
+    несколько процессов (воркеры uvicorn), поэтому занятый размер хранится в БД.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE, ttls: Optional[Dict[str, int]] = None):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_http_cache_accessed_at ON http_cache (accessed_at)")
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS http_cache_size (total INTEGER NOT NULL)")
+            # Сумма по таблице считается один раз, когда строки размера еще нет
+            self._conn.execute(
+                "INSERT INTO http_cache_size SELECT coalesce(sum(size), 0) FROM http_cache "
+                "WHERE NOT EXISTS (SELECT 1 FROM http_cache_size)"
+            )
+            for ddl in SIZE_TRIGGERS_DDL:
+                self._conn.execute(ddl)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._size = self._total_size()
+
+    @classmethod
+    def from_env(cls) -> Optional['HttpCache']:
+        """Кэш по настройкам окружения; пустой MEGANORM_HTTP_CACHE отключает кэширование"""
+        path = os.getenv("MEGANORM_HTTP_CACHE", "./http_cache.db")
+        if not path:
+            return None
+        ttls = {
+            url_class: int(os.getenv(f"MEGANORM_HTTP_CACHE_TTL_{url_class.upper()}", ttl))
+            for url_class, ttl in DEFAULT_TTLS.items()
+        }
+        max_size = int(os.getenv("MEGANORM_HTTP_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE))
+        return cls(path, max_size=max_size, ttls=ttls)
+
+    @staticmethod
+    def classify(url: str) -> str:
+        """Класс URL для выбора срока жизни: types, listing или document"""
+        path = urlparse(url).path
+        if path.endswith('/fire.html'):
+            return 'types'
+        if '/0/' not in path and re.search(r'_\d+\.html$', path):
+            return 'listing'
+        return 'document'
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttls[self.classify(entry.url)]
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, content_type, etag, last_modified, stored_at, accessed_at "
+                "FROM http_cache WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if now - row[5] > ACCESS_RESOLUTION:
+                self._conn.execute("UPDATE http_cache SET accessed_at = ? WHERE url = ?", (now, url))
+
+        headers = {
+            name: value
+            for name, value in zip(STORED_HEADERS, row[1:4])
+            if value is not None
+        }
+        return CacheEntry(url, zlib.decompress(row[0]), headers, row[4], now)
+
+    def store(self, url: str, body: bytes, headers) -> None:
+        """Сохраняет успешный ответ; headers - любой регистронезависимый словарь заголовков"""
+        compressed = zlib.compress(body, 6)
+        values = [headers.get(name) for name in STORED_HEADERS]
+        now = time.time()
+
+        with self._lock:
+            # Запись, чтение размера и вытеснение - одна транзакция, чтобы другие процессы
+            # не меняли кэш между ними
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Не INSERT OR REPLACE: замена строки не вызывает триггер удаления и размер разошелся бы
+                self._conn.execute(
+                    "INSERT INTO http_cache "
+                    "(url, body, content_type, etag, last_modified, stored_at, accessed_at, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (url) DO UPDATE SET body = excluded.body, content_type = excluded.content_type, "
+                    "etag = excluded.etag, last_modified = excluded.last_modified, stored_at = excluded.stored_at, "
+                    "accessed_at = excluded.accessed_at, size = excluded.size",
+                    (url, compressed, *values, now, now, len(compressed))
+                )
+                self._size = self._total_size()
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.stats['stores'] += 1
+
+    def refresh(self, url: str) -> None:
+        """Продлевает срок жизни записи после ответа 304 Not Modified"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE http_cache SET stored_at = ?, accessed_at = ? WHERE url = ?", (now, now, url)
+            )
+            self.stats['revalidations'] += 1
+
+    def record(self, event: str) -> None:
+        with self._lock:
+            self.stats[event] += 1
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT total FROM http_cache_size").fetchone()[0]
+
+    def _evict(self) -> None:
+        # Вызывается под self._lock внутри транзакции store
+        while self._size > self.max_size:
+            rows = self._conn.execute(
+                "SELECT url, size FROM http_cache ORDER BY accessed_at LIMIT 32"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+
+            evicted = []
+            for url, size in rows:
+                if self._size <= self.max_size:
+                    break
+                evicted.append((url,))
+                self._size -= size
+            self._conn.executemany("DELETE FROM http_cache WHERE url = ?", evicted)
+            self.stats['evictions'] += len(evicted)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._size = self._total_size()
+            return dict(self.stats, size=self._size, max_size=self.max_size)
+
+
+class CachingAdapter(BaseAdapter):
+    """Транспортный адаптер requests, который обслуживает GET-запросы из HttpCache,
+    а в сеть обращается через вложенный адаптер"""
+
+    def __init__(self, cache: HttpCache, adapter: Optional[BaseAdapter] = None):
+        super().__init__()
+        self.cache = cache
+        self.adapter = adapter or HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return self.adapter.send(request, **kwargs)
+
+        entry = self.cache.lookup(request.url)
+        if entry and self.cache.is_fresh(entry) and not requires_revalidation(request.headers):
+            self.cache.record('hits')
+            return self._cached_response(request, entry)
+
+        if entry:
+            request.headers.update(entry.validators())
+
+        response = self.adapter.send(request, **kwargs)
+
+        if entry and response.status_code == 304:
+            response.close()
+            self.cache.refresh(request.url)
+            return self._cached_response(request, entry)
+
+        self.cache.record('misses')
+        if response.status_code == 200:
+            self.cache.store(request.url, response.content, response.headers)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+    def _cached_response(self, request, entry: CacheEntry) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry.body
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """Асинхронный транспорт httpx поверх HttpCache; обращения к диску выполняются в потоках"""
+
+    def __init__(self, cache: HttpCache, transport: httpx.AsyncBaseTransport):
+        self.cache = cache
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != 'GET':
+            return await self.transport.handle_async_request(request)
+
+        url = str(request.url)
+        entry = await asyncio.to_thread(self.cache.lookup, url)
+        if entry and self.cache.is_fresh(entry) and not requires_revalidation(request.headers):
+            self.cache.record('hits')
+            return self._cached_response(request, entry)
+
+        if entry:
+            request.headers.update(entry.validators())
+
+        response = await self.transport.handle_async_request(request)
+
+        if entry and response.status_code == 304:
+            await response.aclose()
+            await asyncio.to_thread(self.cache.refresh, url)
+            return self._cached_response(request, entry)
+
+        self.cache.record('misses')
+        if response.status_code == 200:
+            body = await response.aread()
+            await asyncio.to_thread(self.cache.store, url, body, response.headers)
+        return response
+
+    def _cached_response(self, request: httpx.Request, entry: CacheEntry) -> httpx.Response:
+        return httpx.Response(200, headers=entry.headers, content=entry.body, request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -1,24 +1,187 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
-import json
-from .models import DocumentType, Document, DocumentDetail, SearchResponse
-from .scraper import MeganormScraper
-from .database import get_db, create_tables, DocumentTypeDB, DocumentDB
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session, selectinload
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import date, datetime
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import time
+from .models import (
+    DocumentType, Document, DocumentDetail, DocumentBatchRequest, DocumentSection, DocumentOutline,
+    SectionContent, SearchResponse
+)
+from .scraper import AsyncMeganormScraper, BASE_URL
+from .http_cache import HttpCache
+from .concurrency import HostBudget, UpstreamError, STAT_KEYS, aiter_completed
+from .database import create_tables, run_db, SessionLocal, DocumentTypeDB, DocumentDB
+from .coalesce import SingleFlight
+from .type_registry import default_type_registry
+from .upstream import CircuitBreaker, CircuitOpenError, NegativeCache
+from .freshness import FreshnessPolicy, FRESH, STALE, EXPIRED
+from .compression import decompress_text, iter_decompressed_text, decompress_text_range
+from .crawler import Crawler
+from .metrics import REGISTRY, CONTENT_TYPE, MetricsMiddleware
+from .profiling import Profiler, ProfilingMiddleware
+from .export import EXPORT_KINDS, gzip_chunks, iter_export, ndjson_lines
+from .normalize import document_fields, split_number
+from . import search as search_index
+from . import store
+import os
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Meganorm API",
     description="API для извлечения документов по пожарной безопасности с сайта meganorm.ru",
     version="1.0.0"
 )
-
+# Время ответа каждого эндпоинта для /metrics
+app.add_middleware(MetricsMiddleware)
 # Создаем таблицы при запуске
 create_tables()
 
-scraper = MeganormScraper()
-executor = ThreadPoolExecutor(max_workers=4)
+# Дисковый HTTP-кэш страниц meganorm.ru (MEGANORM_HTTP_CACHE="" отключает его)
+http_cache = HttpCache.from_env()
+
+# Лимит запросов к meganorm.ru (token bucket на хост) с повторами после 429, 5xx и таймаутов
+budget = HostBudget(
+    max_concurrent=int(os.getenv("MEGANORM_HOST_MAX_CONCURRENT", "4")),
+    min_interval=float(os.getenv("MEGANORM_HOST_MIN_INTERVAL", "0.2")),
+    burst=int(os.getenv("MEGANORM_HOST_BURST", "1")),
+    retries=int(os.getenv("MEGANORM_HOST_RETRIES", "3"))
+)
+
+# Предохранитель: после серии неудачных загрузок запросы к сайту сразу завершаются ошибкой
+breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("MEGANORM_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("MEGANORM_BREAKER_RESET", "30"))
+)
+
+# Адреса, по которым недавно не нашлось документа или страницы списка
+not_found = NegativeCache(ttl=float(os.getenv("MEGANORM_NEGATIVE_TTL", "600")))
+
+# Сроки свежести сохраненных документов: устаревшие обновляются в фоне, просроченные - сразу
+freshness = FreshnessPolicy.from_env()
+
+# Сколько сохраненных документов отдавать на страницу списка, пока сайт недоступен
+STALE_LISTING_PAGE_SIZE = 100
+
+# Размер куска текста в /document/stream: байт сжатого хранилища или символов загруженного текста
+DOCUMENT_STREAM_CHUNK = 64 * 1024
+
+# /documents/batch: сколько URL принимается за раз и сколько недостающих документов
+# загружается с сайта одновременно (общий лимит запросов к хосту при этом соблюдается)
+BATCH_MAX_URLS = int(os.getenv("MEGANORM_BATCH_MAX_URLS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("MEGANORM_BATCH_CONCURRENCY", "8"))
+
+# Типы документов в памяти процесса, общие для эндпоинтов и скраперов; сбрасываются /refresh-types
+types_registry = default_type_registry
+
+# Число одновременных запросов к meganorm.ru ограничено пулом соединений, а не числом потоков
+scraper = AsyncMeganormScraper(
+    max_connections=int(os.getenv("MEGANORM_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("MEGANORM_MAX_KEEPALIVE", "10")),
+    cache=http_cache,
+    budget=budget,
+    search_concurrency=int(os.getenv("MEGANORM_SEARCH_CONCURRENCY", "8")),
+    base_url=os.getenv("MEGANORM_BASE_URL", BASE_URL),
+    types=types_registry,
+    breaker=breaker
+)
+
+# Сколько по умолчанию длится поиск на сайте внутри /search, мс; найденное к этому
+# времени отдается с partial=true и токеном продолжения
+SEARCH_TIMEOUT_MS = int(os.getenv("MEGANORM_SEARCH_TIMEOUT_MS", "5000"))
+
+# Одновременные промахи по одному ключу объединяются в один запрос к сайту и одну запись в БД
+flights = SingleFlight()
+
+# Профилирование выбранных запросов (MEGANORM_PROFILE=1), профили отдает /profiles;
+# в профиль попадают и общие загрузки, которых ждет запрос
+profiler = Profiler.from_env(background=flights.tasks)
+if profiler:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+
+# Фоновый обход сайта в локальное хранилище (MEGANORM_CRAWLER=1); при включенном обходе
+# поиск читает только локальную БД и не обходит сайт внутри запроса
+crawler = None
+if os.getenv("MEGANORM_CRAWLER") == "1":
+    crawler = Crawler(scraper, concurrency=int(os.getenv("MEGANORM_CRAWLER_CONCURRENCY", "4")))
+
+
+def _collect_metrics():
+    """Счетчики кэшей, бюджета запросов и предохранителей; читаются в момент запроса /metrics"""
+    families = []
+    if http_cache:
+        cache_stats = http_cache.get_stats()
+        families.append((
+            'meganorm_http_cache_events_total', 'counter', 'События HTTP-кэша страниц',
+            [({'event': event}, cache_stats[event])
+             for event in ('hits', 'misses', 'revalidations', 'stores', 'evictions')]
+        ))
+        families.append((
+            'meganorm_http_cache_size_bytes', 'gauge', 'Размер HTTP-кэша страниц', [({}, cache_stats['size'])]
+        ))
+    upstream = budget.get_stats()
+    families.append((
+        'meganorm_upstream_events_total', 'counter',
+        'Запросы к сайту по хостам: requests, retries, throttled, server_errors, network_errors, gave_up',
+        [({'host': host, 'event': key}, stats[key])
+         for host, stats in upstream.items() for key in STAT_KEYS if key != 'wait_seconds']
+    ))
+    families.append((
+        'meganorm_upstream_wait_seconds_total', 'counter', 'Ожидание лимита запросов и пауз перед повтором',
+        [({'host': host}, stats['wait_seconds']) for host, stats in upstream.items()]
+    ))
+    families.append((
+        'meganorm_circuit_open', 'gauge', 'Разомкнут ли предохранитель хоста',
+        [({'host': host}, int(status['state'] != 'closed')) for host, status in breaker.get_status().items()]
+    ))
+    negative = not_found.get_stats()
+    families.append((
+        'meganorm_negative_cache_hits_total', 'counter', 'Запросы, отвеченные отрицательным кэшем без сайта',
+        [({}, negative['hits'])]
+    ))
+    families.append((
+        'meganorm_negative_cache_size', 'gauge', 'Адреса в отрицательном кэше', [({}, negative['size'])]
+    ))
+    families.append((
+        'meganorm_flights_in_progress', 'gauge', 'Загрузки с сайта, общие для одновременных запросов',
+        [({}, flights.in_flight())]
+    ))
+    return families
+
+
+REGISTRY.add_collector(_collect_metrics)
+
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    # Сайт недоступен: это не "не найдено", клиент может повторить запрос позже
+    if isinstance(exc, CircuitOpenError):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Сайт meganorm.ru недоступен, запросы к нему временно приостановлены"},
+            headers={"Retry-After": str(max(1, round(exc.retry_in)))}
+        )
+    logger.error(f"Сайт недоступен: {exc}")
+    return JSONResponse(status_code=502, content={"detail": "Сайт meganorm.ru временно недоступен"})
+
+
+@app.on_event("startup")
+async def start_crawler():
+    if crawler:
+        crawler.start()
+
+
+@app.on_event("shutdown")
+async def close_scraper():
+    if crawler:
+        await crawler.stop()
+    await scraper.aclose()
 
 
 @app.get("/")
@@ -26,145 +189,606 @@ async def root():
     return {"message": "Meganorm API - система извлечения документов по пожарной безопасности"}
 
 
-@app.get("/document-types", response_model=List[DocumentType])
-async def get_document_types(db: Session = Depends(get_db)):
-    """Получить все типы документов"""
+async def _load_document_types() -> List[dict]:
+    types_data = await scraper.get_document_types()
 
-    # Проверяем, есть ли данные в БД
-    db_types = db.query(DocumentTypeDB).all()
+    # Сохраняем в БД
+    await run_db(store.save_document_types, types_data)
+    return types_data
 
-    if not db_types:
-        # Если нет данных в БД, получаем с сайта
-        loop = asyncio.get_event_loop()
-        types_data = await loop.run_in_executor(executor, scraper.get_document_types)
 
-        # Сохраняем в БД
-        for type_data in types_data:
-            db_type = DocumentTypeDB(
-                name=type_data['name'],
-                url=type_data['url']
+def _stored_document_types(db: Session) -> List[dict]:
+    return [
+        {'name': db_type.name, 'url': db_type.url, 'count': db_type.count}
+        for db_type in db.query(DocumentTypeDB)
+    ]
+
+
+async def _document_types() -> List[dict]:
+    """Типы документов из реестра; устаревший реестр заполняется из БД, а пустая БД - с сайта"""
+    types_data = types_registry.get()
+    if types_data is not None:
+        return types_data
+
+    types_data = await run_db(_stored_document_types)
+
+    if types_data:
+        types_registry.set(types_data)
+        return types_data
+    return await flights.do('document-types', _load_document_types)
+
+
+def _stored_listing(db: Session, type_name: str, page: int) -> List[dict]:
+    """Сохраненные документы типа для ответа, пока сайт недоступен"""
+    return [
+        {'title': title, 'url': url, 'date_published': date_published, 'number': number}
+        for title, url, date_published, number in (
+            db.query(DocumentDB.title, DocumentDB.url, DocumentDB.date_published, DocumentDB.number)
+            .filter(DocumentDB.doc_type == type_name)
+            .order_by(DocumentDB.id)
+            .offset(page * STALE_LISTING_PAGE_SIZE)
+            .limit(STALE_LISTING_PAGE_SIZE)
+        )
+    ]
+
+
+async def _load_listing(type_url: str, type_name: str, page: int) -> List[dict]:
+    documents_data = await scraper.get_documents_by_type(type_url, page)
+    if not documents_data:
+        not_found.add(scraper.listing_url(type_url, page))
+        return documents_data
+
+    await run_db(store.save_listing, type_name, documents_data)
+    return documents_data
+
+
+def _save_document(db: Session, url: str, content_data: dict) -> DocumentDetail:
+    db_doc = store.save_document_content(db, url, content_data)
+    return DocumentDetail(
+        title=content_data['title'],
+        url=url,
+        doc_type=db_doc.doc_type,
+        date_published=db_doc.date_published,
+        number=db_doc.number,
+        content=content_data['content'],
+        sections=content_data['sections']
+    )
+
+
+async def _fetch_document(url: str, revalidate: bool = False) -> Optional[dict]:
+    """Загружает и разбирает документ без сохранения; None, если документа нет.
+
+    revalidate - сохраненная версия устарела, поэтому страница проверяется на сайте,
+    даже если HTTP-кэш считает ее свежей
+    """
+    content_data = await scraper.get_document_content(url, revalidate)
+
+    if not content_data['content']:
+        not_found.add(url)
+        return None
+    return content_data
+
+
+async def _load_document(url: str, revalidate: bool = False) -> Optional[DocumentDetail]:
+    """Загружает и сохраняет документ; загрузка общая с пакетами (ключ ('fetch', url))"""
+    content_data = await flights.do(('fetch', url), _fetch_document, url, revalidate)
+    if content_data is None:
+        return None
+
+    return await run_db(_save_document, url, content_data)
+
+
+def _stored_outline(db: Session, url: str) -> Tuple[bool, Optional[dict]]:
+    """Есть ли документ в БД и, если у него есть текст и оглавление, они сами"""
+    db_doc = db.query(DocumentDB).filter(DocumentDB.url == url).first()
+    if not (db_doc and db_doc.body and db_doc.outline):
+        return db_doc is not None, None
+    return True, {
+        'url': db_doc.url,
+        'title': db_doc.title,
+        'content_z': db_doc.body.content_z,
+        'outline': [
+            DocumentSection(
+                id=section.position,
+                level=section.level,
+                heading=section.heading,
+                parent=section.parent,
+                start=section.start,
+                end=section.end
             )
-            db.add(db_type)
+            for section in db_doc.outline
+        ],
+    }
+
+
+async def _sectioned_document(url: str) -> Optional[dict]:
+    """Сохраненный документ с оглавлением; документ без него загружается с сайта и разбивается на разделы"""
+    exists, document = await run_db(_stored_outline, url)
+    if document is not None:
+        return document
+
+    if not exists and url in not_found:
+        return None
+
+    # Документы, сохраненные до появления оглавлений, разбиваются при повторной загрузке
+    if await flights.do(('document', url), _load_document, url) is None:
+        return None
+    return (await run_db(_stored_outline, url))[1]
+
+
+async def _refresh_document(url: str) -> Optional[DocumentDetail]:
+    """Фоновое обновление устаревшего документа. Ошибка записывается в лог и передается
+    запросам, присоединившимся к той же задаче: для них это 502/503, а не 404"""
+    try:
+        return await _load_document(url, True)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить документ {url}: {e}")
+        raise
+
+
+def _stored_meta(db_doc: DocumentDB) -> dict:
+    return {
+        'title': db_doc.title,
+        'url': db_doc.url,
+        'doc_type': db_doc.doc_type,
+        'date_published': db_doc.date_published,
+        'number': db_doc.number,
+        'sections': json.loads(db_doc.sections) if db_doc.sections else [],
+    }
+
+
+def _stored_document(db: Session, url: str) -> Optional[Tuple[DocumentDetail, Optional[datetime]]]:
+    """Сохраненный документ с текстом и время его обновления; текст распаковывается здесь же, в потоке БД"""
+    db_doc = db.query(DocumentDB).filter(DocumentDB.url == url).first()
+    # Текст хранится сжатым и распаковывается при каждом обращении к content
+    content = db_doc.content if db_doc else None
+    if not content:
+        return None
+    return DocumentDetail(content=content, **_stored_meta(db_doc)), db_doc.last_updated
+
+
+def _stored_stream(db: Session, url: str) -> Optional[Tuple[dict, bytes, Optional[datetime]]]:
+    """Метаданные, сжатый текст и время обновления сохраненного документа"""
+    db_doc = db.query(DocumentDB).filter(DocumentDB.url == url).first()
+    content_z = db_doc.body.content_z if db_doc and db_doc.body else None
+    if not content_z:
+        return None
+    return _stored_meta(db_doc), content_z, db_doc.last_updated
+
+
+def _mark_freshness(response: Response, state: str, last_updated: Optional[datetime]) -> None:
+    response.headers["X-Freshness"] = state
+    if last_updated:
+        response.headers["Age"] = str(max(0, int((datetime.utcnow() - last_updated).total_seconds())))
+    if state != FRESH:
+        response.headers["Warning"] = '110 - "Response is Stale"'
+
+
+def _ndjson_line(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def _ndjson_document(meta: dict, chunks: Iterable[str]) -> Iterator[bytes]:
+    """Документ строками NDJSON: метаданные, куски текста со смещением и итоговая длина"""
+    yield _ndjson_line({'type': 'meta', **meta})
+    length = 0
+    for chunk in chunks:
+        yield _ndjson_line({'type': 'content', 'offset': length, 'text': chunk})
+        length += len(chunk)
+    yield _ndjson_line({'type': 'end', 'length': length})
+
+
+def _stream_loaded_document(document: DocumentDetail) -> StreamingResponse:
+    """Поток только что загруженного с сайта документа: текст уже целиком в памяти,
+    куски нарезаются из него"""
+    meta = {
+        'title': document.title,
+        'url': document.url,
+        'doc_type': document.doc_type,
+        'date_published': document.date_published,
+        'number': document.number,
+        'sections': document.sections,
+    }
+    content = document.content
+    chunks = (content[i:i + DOCUMENT_STREAM_CHUNK] for i in range(0, len(content), DOCUMENT_STREAM_CHUNK))
+    response = StreamingResponse(_ndjson_document(meta, chunks), media_type="application/x-ndjson")
+    _mark_freshness(response, FRESH, None)
+    return response
+
 
-        db.commit()
-        db_types = db.query(DocumentTypeDB).all()
+@app.get("/document-types", response_model=List[DocumentType])
+async def get_document_types():
+    """Получить все типы документов"""
 
     return [
         DocumentType(
-            name=db_type.name,
-            url=db_type.url,
-            count=db_type.count
+            name=type_data['name'],
+            url=type_data['url'],
+            count=type_data.get('count')
         )
-        for db_type in db_types
+        for type_data in await _document_types()
     ]
 
 
 @app.get("/documents/{doc_type}", response_model=List[Document])
 async def get_documents_by_type(
         doc_type: str,
-        page: int = Query(0, ge=0, description="Номер страницы"),
-        db: Session = Depends(get_db)
+        response: Response,
+        page: int = Query(0, ge=0, description="Номер страницы")
 ):
     """Получить документы определенного типа"""
 
-    # Находим тип документа в БД
-    db_type = db.query(DocumentTypeDB).filter(DocumentTypeDB.name.ilike(f"%{doc_type}%")).first()
+    # Находим тип документа по имени в реестре типов без обращения к БД
+    await _document_types()
+    type_data = types_registry.resolve(doc_type)
 
-    if not db_type:
+    if not type_data:
         raise HTTPException(status_code=404, detail="Тип документа не найден")
 
-    # Получаем документы с сайта
-    loop = asyncio.get_event_loop()
-    documents_data = await loop.run_in_executor(
-        executor,
-        scraper.get_documents_by_type,
-        db_type.url,
-        page
-    )
+    # Страница, которая недавно оказалась пустой, не запрашивается повторно
+    if scraper.listing_url(type_data['url'], page) in not_found:
+        return []
 
-    documents = []
-    for doc_data in documents_data:
-        # Проверяем, есть ли документ в БД
-        db_doc = db.query(DocumentDB).filter(DocumentDB.url == doc_data['url']).first()
-
-        if not db_doc:
-            # Сохраняем новый документ
-            db_doc = DocumentDB(
-                title=doc_data['title'],
-                url=doc_data['url'],
-                doc_type=db_type.name,
-                date_published=doc_data.get('date_published'),
-                number=doc_data.get('number')
-            )
-            db.add(db_doc)
+    # Получаем документы с сайта
+    try:
+        documents_data = await flights.do(
+            ('listing', type_data['url'], page),
+            _load_listing, type_data['url'], type_data['name'], page
+        )
+    except UpstreamError:
+        # Сайт недоступен: отдаем сохраненные документы этого типа и помечаем ответ устаревшим
+        documents_data = await run_db(_stored_listing, type_data['name'], page)
+        if not documents_data:
+            raise
+        response.headers["Warning"] = '110 - "Response is Stale"'
 
-        documents.append(Document(
+    return [
+        Document(
             title=doc_data['title'],
             url=doc_data['url'],
-            doc_type=db_type.name,
+            doc_type=type_data['name'],
             date_published=doc_data.get('date_published'),
             number=doc_data.get('number')
-        ))
-
-    db.commit()
-    return documents
+        )
+        for doc_data in documents_data
+    ]
 
 
 @app.get("/document", response_model=DocumentDetail)
 async def get_document_content(
-        url: str = Query(..., description="URL документа"),
-        db: Session = Depends(get_db)
+        response: Response,
+        url: str = Query(..., description="URL документа")
 ):
     """Получить полное содержимое документа"""
 
     # Проверяем, есть ли документ в БД с контентом
-    db_doc = db.query(DocumentDB).filter(DocumentDB.url == url).first()
+    found = await run_db(_stored_document, url)
+
+    if found:
+        stored, last_updated = found
+        state = freshness.state(stored.doc_type, last_updated)
+
+        if state == STALE:
+            # Отдаем сохраненную версию сразу, а обновляем ее в фоне
+            flights.start(('document', url), _refresh_document, url)
+        elif state == EXPIRED:
+            # Сохраненная версия слишком старая: загружаем заново, а при неудаче отдаем ее
+            try:
+                document = await flights.do(('document', url), _load_document, url, True)
+            except UpstreamError as e:
+                logger.warning(f"Не удалось обновить документ {url}: {e}")
+                document = None
+            if document is not None:
+                _mark_freshness(response, FRESH, None)
+                return document
+
+        _mark_freshness(response, state, last_updated)
+        if state == EXPIRED:
+            response.headers["Warning"] = '110 - "Response is Stale", 111 - "Revalidation Failed"'
+        return stored
+
+    # Недавно здесь не нашлось документа - не обращаемся к сайту повторно
+    if url in not_found:
+        raise HTTPException(status_code=404, detail="Документ не найден или недоступен")
+
+    # Получаем контент с сайта: одновременные запросы одного URL ждут общую загрузку
+    document = await flights.do(('document', url), _load_document, url)
+
+    if document is None:
+        raise HTTPException(status_code=404, detail="Документ не найден или недоступен")
+
+    return document
 
-    if db_doc and db_doc.content:
-        sections = json.loads(db_doc.sections) if db_doc.sections else []
-        return DocumentDetail(
-            title=db_doc.title,
-            url=db_doc.url,
-            doc_type=db_doc.doc_type,
-            date_published=db_doc.date_published,
-            number=db_doc.number,
-            content=db_doc.content,
-            sections=sections
+
+@app.get("/document/stream")
+async def stream_document_content(
+        url: str = Query(..., description="URL документа")
+):
+    """Содержимое документа потоком NDJSON: сначала метаданные, затем текст кусками.
+
+    Постепенно отдается только сохраненный документ: его текст распаковывается по мере
+    отправки и не собирается в памяти целиком. Документ, который загружается с сайта
+    (нового нет в БД, просроченный перезагружается), сначала целиком разбирается
+    и сохраняется, как в /document, и лишь затем отправляется кусками.
+    Заголовки свежести те же, что у /document.
+    """
+    found = await run_db(_stored_stream, url)
+
+    if found:
+        meta, content_z, last_updated = found
+        state = freshness.state(meta['doc_type'], last_updated)
+
+        if state == STALE:
+            flights.start(('document', url), _refresh_document, url)
+        elif state == EXPIRED:
+            try:
+                document = await flights.do(('document', url), _load_document, url, True)
+            except UpstreamError as e:
+                logger.warning(f"Не удалось обновить документ {url}: {e}")
+                document = None
+            if document is not None:
+                return _stream_loaded_document(document)
+
+        response = StreamingResponse(
+            _ndjson_document(meta, iter_decompressed_text(content_z, DOCUMENT_STREAM_CHUNK)),
+            media_type="application/x-ndjson"
         )
+        _mark_freshness(response, state, last_updated)
+        if state == EXPIRED:
+            response.headers["Warning"] = '110 - "Response is Stale", 111 - "Revalidation Failed"'
+        return response
 
-    # Получаем контент с сайта
-    loop = asyncio.get_event_loop()
-    content_data = await loop.run_in_executor(executor, scraper.get_document_content, url)
+    if url in not_found:
+        raise HTTPException(status_code=404, detail="Документ не найден или недоступен")
 
-    if not content_data['content']:
+    # Документ загружается и сохраняется так же, как в /document, и отдается кусками после разбора
+    document = await flights.do(('document', url), _load_document, url)
+    if document is None:
         raise HTTPException(status_code=404, detail="Документ не найден или недоступен")
+    return _stream_loaded_document(document)
+
+
+@app.get("/document/toc", response_model=DocumentOutline)
+async def get_document_toc(
+        url: str = Query(..., description="URL документа")
+):
+    """Оглавление документа: разделы с уровнями, родителями и границами в тексте"""
+
+    document = await _sectioned_document(url)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Документ не найден или недоступен")
+
+    sections = document['outline']
+    return DocumentOutline(url=document['url'], title=document['title'], length=sections[0].end, sections=sections)
+
 
-    # Обновляем или создаем запись в БД
-    if db_doc:
-        db_doc.content = content_data['content']
-        db_doc.sections = json.dumps(content_data['sections'])
-        if not db_doc.title:
-            db_doc.title = content_data['title']
+@app.get("/document/section", response_model=SectionContent)
+async def get_document_section(
+        url: str = Query(..., description="URL документа"),
+        id: int = Query(..., ge=0, description="Номер раздела из оглавления"),
+        to: Optional[int] = Query(None, ge=0, description="Последний раздел диапазона; по умолчанию id")
+):
+    """Текст раздела документа или диапазона разделов id..to вместе с подразделами"""
+
+    document = await _sectioned_document(url)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Документ не найден или недоступен")
+
+    outline = document['outline']
+    last = id if to is None else to
+    if last < id:
+        raise HTTPException(status_code=400, detail="Конец диапазона раньше его начала")
+    if last >= len(outline):
+        raise HTTPException(status_code=404, detail="Раздел не найден")
+
+    # Распаковывается только начало текста до конца диапазона
+    start, end = outline[id].start, max(section.end for section in outline[id:last + 1])
+    return SectionContent(
+        url=document['url'],
+        id=id,
+        to=last,
+        heading=outline[id].heading,
+        start=start,
+        end=end,
+        content=await asyncio.to_thread(decompress_text_range, document['content_z'], start, end)
+    )
+
+
+def _stored_batch(db: Session, urls: List[str]) -> Dict[str, dict]:
+    """Сохраненные строки документов пакета одним запросом: метаданные, сжатый текст и время обновления"""
+    query = (
+        db.query(DocumentDB)
+        .options(selectinload(DocumentDB.body))
+        .filter(DocumentDB.url.in_(urls))
+    )
+    return {
+        db_doc.url: {
+            'meta': _stored_meta(db_doc),
+            'content_z': db_doc.body.content_z if db_doc.body else None,
+            'last_updated': db_doc.last_updated,
+        }
+        for db_doc in query
+    }
+
+
+def _batch_error(url: str, error: Optional[Exception]) -> bytes:
+    if error is None:
+        return _ndjson_line({'type': 'error', 'url': url, 'status': 404,
+                             'detail': 'Документ не найден или недоступен'})
+    if isinstance(error, CircuitOpenError):
+        return _ndjson_line({'type': 'error', 'url': url, 'status': 503,
+                             'detail': 'Запросы к сайту временно приостановлены'})
+    if isinstance(error, UpstreamError):
+        return _ndjson_line({'type': 'error', 'url': url, 'status': 502, 'detail': 'Сайт временно недоступен'})
+    return _ndjson_line({'type': 'error', 'url': url, 'status': 500, 'detail': 'Не удалось загрузить документ'})
+
+
+async def _save_batch(documents: Dict[str, dict]) -> int:
+    """Сохраняет загруженные документы пакета одной транзакцией; возвращает их число или 0 при ошибке"""
+    try:
+        return len(await run_db(store.save_documents_content, documents))
+    except Exception as e:
+        logger.error(f"Не удалось сохранить документы пакета: {e}")
+        return 0
+
+
+async def _batch_documents(urls: List[str]) -> AsyncIterator[bytes]:
+    """Строки NDJSON пакета: сначала сохраненные документы, затем загруженные с сайта
+    по мере готовности, в конце итог.
+
+    Недостающие документы загружаются общими с /document задачами (ключ ('fetch', url)):
+    одновременный запрос того же URL не обращается к сайту повторно. Загруженное
+    сохраняется одной транзакцией в конце, в том числе если клиент отключился раньше.
+    """
+    stored = await run_db(_stored_batch, urls)
+    # expired - просроченные документы, которые не удалось обновить и отдали из БД
+    counts = dict.fromkeys(('stored', 'fetched', 'expired', 'failed'), 0)
+
+    async def stored_line(row: dict, state: str) -> bytes:
+        counts['expired' if state == EXPIRED else 'stored'] += 1
+        content = await asyncio.to_thread(decompress_text, row['content_z'])
+        return _ndjson_line({'type': 'document', 'source': 'stored', 'freshness': state,
+                             **row['meta'], 'content': content})
+
+    misses = []
+    for url in urls:
+        row = stored.get(url)
+        state = freshness.state(row['meta']['doc_type'], row['last_updated']) if row and row['content_z'] else None
+        if state in (FRESH, STALE):
+            if state == STALE:
+                flights.start(('document', url), _refresh_document, url)
+            yield await stored_line(row, state)
+        elif state is None and url in not_found:
+            counts['failed'] += 1
+            yield _batch_error(url, None)
+        else:
+            # Нет текста или он просрочен: загружаем заново, а при неудаче отдаем сохраненный
+            misses.append(url)
+
+    async def fetch(url: str):
+        # Просроченный текст проверяется на сайте в обход свежей записи HTTP-кэша
+        revalidate = url in stored and stored[url]['content_z'] is not None
+        try:
+            return url, await flights.do(('fetch', url), _fetch_document, url, revalidate), None
+        except UpstreamError as e:
+            return url, None, e
+        except Exception as e:
+            logger.error(f"Не удалось загрузить документ пакета {url}: {e}")
+            return url, None, e
+
+    fetched = {}
+    saving = None
+    try:
+        async for url, content_data, error in aiter_completed(fetch, misses, BATCH_CONCURRENCY):
+            row = stored.get(url)
+            if content_data is not None:
+                counts['fetched'] += 1
+                fetched[url] = content_data
+                meta = row['meta'] if row else {'doc_type': store.UNKNOWN_TYPE}
+                yield _ndjson_line({
+                    'type': 'document',
+                    'source': 'fetched',
+                    'freshness': FRESH,
+                    'title': content_data['title'],
+                    'url': url,
+                    'doc_type': meta['doc_type'],
+                    'date_published': meta.get('date_published'),
+                    'number': meta.get('number'),
+                    'sections': content_data['sections'],
+                    'content': content_data['content'],
+                })
+            elif row and row['content_z']:
+                yield await stored_line(row, EXPIRED)
+            else:
+                # Отсутствующий документ _fetch_document уже запомнил в not_found
+                counts['failed'] += 1
+                yield _batch_error(url, error)
+    finally:
+        # Задача сохранения не зависит от генератора: при отключении клиента она завершится сама
+        if fetched:
+            saving = asyncio.ensure_future(_save_batch(fetched))
+
+    saved = await saving if saving is not None else 0
+    yield _ndjson_line({'type': 'end', **counts, 'saved': saved})
+
+
+@app.post("/documents/batch")
+async def get_documents_batch(request: DocumentBatchRequest):
+    """Содержимое нескольких документов потоком NDJSON, по строке на документ.
+
+    Сохраненные документы отдаются из БД сразу, недостающие и просроченные загружаются
+    с сайта одновременно (не больше MEGANORM_BATCH_CONCURRENCY) и отдаются по мере
+    готовности. Ошибка по отдельному URL приходит строкой type=error с кодом статуса,
+    последняя строка type=end содержит итоговые счетчики.
+    """
+    urls = list(dict.fromkeys(request.urls))
+    if not urls:
+        raise HTTPException(status_code=400, detail="Список URL пуст")
+    if len(urls) > BATCH_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"Не больше {BATCH_MAX_URLS} URL за один запрос")
+    return StreamingResponse(_batch_documents(urls), media_type="application/x-ndjson")
+
+
+def _online_document(doc_data: dict) -> Document:
+    return Document(
+        title=doc_data['title'],
+        url=doc_data['url'],
+        doc_type=doc_data.get('doc_type', store.UNKNOWN_TYPE),
+        date_published=doc_data.get('date_published'),
+        number=doc_data.get('number')
+    )
+
+
+def _online_filter(date_from: Optional[date], date_to: Optional[date], number: Optional[str]):
+    """Проверка найденного на сайте документа фильтрами /search по тем же
+    нормализованным дате и номеру, что хранятся в БД; None, если фильтров нет"""
+    if not (date_from or date_to or number):
+        return None
+    number_prefix, number_key = split_number(number)
+
+    def matches(doc_data: dict) -> bool:
+        fields = document_fields(doc_data['title'], doc_data.get('date_published'), doc_data.get('number'))
+        published_on = fields['published_on']
+        if (date_from or date_to) and published_on is None:
+            return False
+        if (date_from and published_on < date_from) or (date_to and published_on > date_to):
+            return False
+        if number and (fields['number_key'] != number_key
+                       or (number_prefix and fields['number_prefix'] != number_prefix)):
+            return False
+        return True
+
+    return matches
+
+
+async def _continue_search(q: str, doc_type: Optional[str], per_page: int, page: int,
+                           continuation: str, deadline: float, matches=None) -> SearchResponse:
+    """Следующие совпадения на сайте по токену продолжения; БД при этом не читается,
+    ее результаты уже отданы в ответе, выдавшем токен"""
+    try:
+        token_q, token_doc_type, pending = search_index.decode_continuation(continuation)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if (token_q, token_doc_type) != (q, doc_type):
+        raise HTTPException(status_code=400, detail="Токен продолжения выдан для другого запроса")
+
+    # Пока сайт недоступен, обход не продвигается: возвращаем тот же токен, чтобы не потерять типы
+    if breaker.is_open(scraper.types_url):
+        online_docs, partial = [], True
     else:
-        db_doc = DocumentDB(
-            title=content_data['title'],
-            url=url,
-            doc_type="Неизвестно",
-            content=content_data['content'],
-            sections=json.dumps(content_data['sections'])
+        online_docs, pending, partial = await scraper.search_documents_until(
+            q, doc_type, limit=per_page, timeout=max(0.0, deadline - time.monotonic()), pending=pending
         )
-        db.add(db_doc)
-
-    db.commit()
 
-    return DocumentDetail(
-        title=content_data['title'],
-        url=url,
-        doc_type=db_doc.doc_type,
-        date_published=db_doc.date_published,
-        number=db_doc.number,
-        content=content_data['content'],
-        sections=content_data['sections']
+    documents = [_online_document(doc_data) for doc_data in online_docs if matches is None or matches(doc_data)]
+    return SearchResponse(
+        documents=documents,
+        total=len(documents),
+        total_exact=not pending,
+        page=page,
+        per_page=per_page,
+        partial=partial,
+        continuation=search_index.encode_continuation(q, doc_type, pending) if pending else None
     )
 
 
@@ -172,83 +796,210 @@ async def get_document_content(
 async def search_documents(
         q: str = Query(..., description="Поисковый запрос"),
         doc_type: Optional[str] = Query(None, description="Фильтр по типу документа"),
+        mode: str = Query("exact", pattern="^(exact|stemmed|fuzzy)$",
+                          description="Режим поиска: exact - по словам, stemmed - по основам слов, "
+                                      "fuzzy - по триграммам с учетом опечаток"),
         page: int = Query(1, ge=1, description="Номер страницы"),
         per_page: int = Query(10, ge=1, le=100, description="Количество результатов на странице"),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor "
+                                                        "предыдущего ответа; заменяет page"),
+        exact_total: bool = Query(False, description="Точно посчитать total; по умолчанию число "
+                                                     "совпадений может быть оценкой"),
+        timeout_ms: Optional[int] = Query(None, ge=1, le=60000,
+                                          description="Сколько ждать поиска на сайте, мс; по умолчанию "
+                                                      "MEGANORM_SEARCH_TIMEOUT_MS"),
+        continuation: Optional[str] = Query(None, description="Токен continuation предыдущего ответа: "
+                                                              "продолжить прерванный поиск на сайте"),
+        date_from: Optional[date] = Query(None, description="Дата принятия не раньше, YYYY-MM-DD"),
+        date_to: Optional[date] = Query(None, description="Дата принятия не позже, YYYY-MM-DD"),
+        number: Optional[str] = Query(None, description="Номер документа: 123-ФЗ, ГОСТ Р 53325-2012 или "
+                                                        "только номер без обозначения")
 ):
     """Поиск документов"""
-
-    # Поиск в БД
-    query = db.query(DocumentDB).filter(DocumentDB.title.ilike(f"%{q}%"))
-
-    if doc_type:
-        query = query.filter(DocumentDB.doc_type.ilike(f"%{doc_type}%"))
-
-    total = query.count()
-    documents_db = query.offset((page - 1) * per_page).limit(per_page).all()
+    deadline = time.monotonic() + (timeout_ms or SEARCH_TIMEOUT_MS) / 1000
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from позже date_to")
+    matches = _online_filter(date_from, date_to, number)
+
+    if continuation:
+        return await _continue_search(q, doc_type, per_page, page, continuation, deadline, matches)
+
+    # Ранжированный поиск по полнотекстовому индексу выбранного режима
+    try:
+        hits, total, total_exact, next_cursor = await run_db(
+            search_index.search_documents, q, doc_type, mode,
+            limit=per_page,
+            offset=(page - 1) * per_page,
+            cursor=cursor,
+            exact_total=exact_total,
+            date_from=date_from,
+            date_to=date_to,
+            number=number
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     documents = [
         Document(
-            title=doc.title,
-            url=doc.url,
-            doc_type=doc.doc_type,
-            date_published=doc.date_published,
-            number=doc.number,
-            content=doc.content[:200] + "..." if doc.content and len(doc.content) > 200 else doc.content
+            title=hit['title'],
+            url=hit['url'],
+            doc_type=hit['doc_type'],
+            date_published=hit['date_published'],
+            number=hit['number'],
+            content=hit['summary'],
+            snippet=hit['snippet'],
+            rank=hit['rank']
         )
-        for doc in documents_db
+        for hit in hits
     ]
+    partial, pending = False, []
 
-    # Если результатов мало, дополнительно ищем на сайте
-    if len(documents) < per_page:
-        loop = asyncio.get_event_loop()
-        online_docs = await loop.run_in_executor(
-            executor,
-            scraper.search_documents,
-            q,
-            doc_type
-        )
+    # Если результатов мало, фоновый обход выключен и сайт доступен, дополнительно ищем на сайте
+    if len(documents) < per_page and not crawler and not breaker.is_open(scraper.types_url):
+        try:
+            online_docs, pending, partial = await scraper.search_documents_until(
+                q, doc_type, limit=per_page, timeout=max(0.0, deadline - time.monotonic())
+            )
+        except UpstreamError as e:
+            # Без сайта отдаем то, что нашлось в БД
+            logger.warning(f"Поиск на сайте недоступен: {e}")
+            online_docs = []
 
         # Добавляем новые документы, которых нет в БД
-        for doc_data in online_docs[:per_page - len(documents)]:
+        for doc_data in online_docs:
+            if len(documents) >= per_page:
+                break
+            if matches is not None and not matches(doc_data):
+                continue
             if not any(d.url == doc_data['url'] for d in documents):
-                documents.append(Document(
-                    title=doc_data['title'],
-                    url=doc_data['url'],
-                    doc_type=doc_data.get('doc_type', 'Неизвестно'),
-                    date_published=doc_data.get('date_published'),
-                    number=doc_data.get('number')
-                ))
+                documents.append(_online_document(doc_data))
 
     return SearchResponse(
         documents=documents,
         total=max(total, len(documents)),
+        total_exact=total_exact and not pending,
         page=page,
-        per_page=per_page
+        per_page=per_page,
+        next_cursor=next_cursor,
+        partial=partial,
+        continuation=search_index.encode_continuation(q, doc_type, pending) if pending else None
     )
 
 
 @app.post("/refresh-types")
-async def refresh_document_types(db: Session = Depends(get_db)):
+async def refresh_document_types():
     """Обновить список типов документов"""
 
-    loop = asyncio.get_event_loop()
-    types_data = await loop.run_in_executor(executor, scraper.get_document_types)
+    # Сбрасываем реестр, чтобы скрапер загрузил типы с сайта заново
+    types_registry.invalidate()
+    types_data = await scraper.get_document_types()
+    await run_db(store.replace_document_types, types_data)
 
-    # Очищаем старые данные
-    db.query(DocumentTypeDB).delete()
+    return {"message": f"Обновлено {len(types_data)} типов документов"}
 
-    # Добавляем новые
-    for type_data in types_data:
-        db_type = DocumentTypeDB(
-            name=type_data['name'],
-            url=type_data['url']
-        )
-        db.add(db_type)
 
-    db.commit()
+@app.get("/crawler/status")
+async def get_crawler_status():
+    """Состояние фонового обхода: размер очереди по видам страниц и счетчики"""
+    if not crawler:
+        return {"enabled": False}
+    return {"enabled": True, **await run_db(crawler.get_status)}
 
-    return {"message": f"Обновлено {len(types_data)} типов документов"}
+
+def _check_database(db: Session) -> None:
+    db.execute(text("SELECT 1"))
+
+
+@app.get("/health")
+async def health():
+    """Состояние сервиса: доступность БД и сайта (предохранители по хостам), отрицательный кэш"""
+    try:
+        await run_db(_check_database)
+        database = "ok"
+    except Exception as e:
+        logger.error(f"БД недоступна: {e}")
+        database = "error"
+
+    upstream = breaker.get_status()
+    if database != "ok":
+        status = "error"
+    elif any(host['state'] != 'closed' for host in upstream.values()):
+        # Сайт недоступен, но сохраненные данные отдаются
+        status = "degraded"
+    else:
+        status = "ok"
+
+    return {
+        "status": status,
+        "database": database,
+        "upstream": upstream,
+        "negative_cache": not_found.get_stats(),
+    }
+
+
+@app.get("/export/{kind}")
+async def export_corpus(
+        kind: str,
+        since: Optional[int] = Query(None, ge=0, description="Только строки с номером изменения больше "
+                                                         "этого: watermark предыдущей выгрузки"),
+        content: bool = Query(True, description="Выгружать текст документов")
+):
+    """Выгрузка сохраненных документов (documents) или типов (types) в NDJSON, сжатом gzip.
+
+    Строки читаются из БД порциями и сжимаются по мере отправки; последняя строка
+    {"type": "end"} содержит watermark для следующей инкрементальной выгрузки.
+    """
+    if kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=404, detail="Неизвестный вид выгрузки")
+
+    def chunks():
+        # Синхронный генератор Starlette читает в пуле потоков, цикл событий не блокируется
+        with SessionLocal() as db:
+            yield from gzip_chunks(ndjson_lines(iter_export(db, kind, since, content)))
+
+    filename = f"meganorm-{kind}-{datetime.utcnow():%Y%m%dT%H%M%SZ}.ndjson.gz"
+    return StreamingResponse(
+        chunks(),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.get("/upstream/stats")
+async def get_upstream_stats():
+    """Счетчики запросов к сайту по хостам: повторы, ответы 429 и 5xx, сетевые ошибки, ожидание лимита"""
+    return budget.get_stats()
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Счетчики HTTP-кэша страниц: попадания, промахи, перепроверки, вытеснения"""
+    if not http_cache:
+        return {"enabled": False}
+    return {"enabled": True, **http_cache.get_stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus: время эндпоинтов и этапов, ответы сайта, кэши"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/profiles")
+async def list_profiles():
+    """Сохраненные профили запросов, новые первыми"""
+    if not profiler:
+        raise HTTPException(status_code=404, detail="Профилирование выключено")
+    return await asyncio.to_thread(profiler.get_profiles)
+
+
+@app.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """Профиль в формате collapsed stacks для speedscope или flamegraph.pl"""
+    path = profiler.file(profile_id) if profiler else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=os.path.basename(path))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Тип содержимого текстового формата Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Семейство метрик, собранное в момент запроса /metrics: имя, тип, описание и значения по меткам
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    """Метрики процесса и функции, которые досчитывают значения при каждом чтении /metrics"""
+
+    def __init__(self):
+        self._metrics: List['_Metric'] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: '_Metric') -> None:
+        self._metrics.append(metric)
+
+    def add_collector(self, collect: Callable[[], Iterable[Family]]) -> None:
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(list(labels), list(labels.values()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        registry.register(self)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = [(labels, self._copy(value)) for labels, value in self._values.items()]
+        for labels, value in values:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _copy(self, value):
+        return value
+
+    def _samples(self, labels: Tuple[str, ...], value) -> List[str]:
+        return [f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Гистограмма: наблюдение - поиск корзины и два сложения под блокировкой"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Счетчики по корзинам (последняя - +Inf) и сумма наблюдений
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _copy(self, value):
+        return list(value[0]), value[1]
+
+    def _samples(self, labels: Tuple[str, ...], value) -> List[str]:
+        counts, total = value
+        names = self.labelnames + ('le',)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+        lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'meganorm_http_request_duration_seconds',
+    'Время обработки запросов API по шаблону пути, методу и коду ответа',
+    ['method', 'route', 'status']
+)
+STAGE_SECONDS = Histogram(
+    'meganorm_stage_duration_seconds',
+    'Время этапов: connect, tls, wait (до заголовков ответа), download, fetch (загрузка целиком), '
+    'parse_queue, parse, extract, db_read, db_write',
+    ['stage']
+)
+UPSTREAM_RESPONSES = Counter(
+    'meganorm_upstream_responses_total',
+    'Ответы сайта на каждую попытку запроса по кодам; error - сетевая ошибка',
+    ['status']
+)
+PARSE_QUEUE = Gauge(
+    'meganorm_parse_queue_depth',
+    'Разборы HTML в пуле потоков: ожидающие и выполняющиеся'
+)
+
+
+def stage(name: str):
+    """Замер этапа; работает и как with, и как декоратор"""
+    return STAGE_SECONDS.time(name)
+
+
+# Шаги httpcore, которые сообщает расширение trace, и этапы, к которым они относятся
+_TRACE_STAGES = {
+    'connect_tcp': 'connect',
+    'connect_unix_socket': 'connect',
+    'start_tls': 'tls',
+    'receive_response_headers': 'wait',
+    'receive_response_body': 'download',
+}
+
+
+def upstream_trace() -> Callable:
+    """Колбэк расширения trace httpx для одного запроса: время соединения, TLS,
+    ожидания заголовков ответа и загрузки тела"""
+    started = {}
+
+    async def trace(event_name: str, info: dict) -> None:
+        step, _, phase = event_name.rpartition('.')
+        stage_name = _TRACE_STAGES.get(step.rpartition('.')[2])
+        if stage_name is None:
+            return
+        if phase == 'started':
+            started[step] = time.perf_counter()
+        elif phase == 'complete' and step in started:
+            STAGE_SECONDS.observe(time.perf_counter() - started.pop(step), stage_name)
+
+    return trace
+
+
+class MetricsMiddleware:
+    """ASGI-прослойка: время каждого запроса до отправки ответа целиком.
+
+    Путь записывается шаблоном маршрута (/documents/{doc_type}), чтобы число рядов не росло.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUEST_SECONDS.observe(time.perf_counter() - started, scope['method'], route, str(status))
@@ -14,6 +14,8 @@ class Document(BaseModel):
     date_published: Optional[str] = None
     number: Optional[str] = None
     content: Optional[str] = None
+    snippet: Optional[str] = None
+    rank: Optional[float] = None
 
 class DocumentDetail(BaseModel):
     title: str
@@ -24,8 +26,38 @@ class DocumentDetail(BaseModel):
     content: str
     sections: List[str] = []
 
+class DocumentBatchRequest(BaseModel):
+    urls: List[str]
+
+class DocumentSection(BaseModel):
+    id: int
+    level: int
+    heading: str
+    parent: Optional[int] = None
+    start: int
+    end: int
+
+class DocumentOutline(BaseModel):
+    url: str
+    title: str
+    length: int
+    sections: List[DocumentSection]
+
+class SectionContent(BaseModel):
+    url: str
+    id: int
+    to: int
+    heading: str
+    start: int
+    end: int
+    content: str
+
 class SearchResponse(BaseModel):
     documents: List[Document]
     total: int
+    total_exact: bool = True
     page: int
-    per_page: int
\ No newline at end of file
+    per_page: int
+    next_cursor: Optional[str] = None
+    partial: bool = False
+    continuation: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,122 @@
+import re
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+
+_ISO_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+_NUMERIC_DATE = re.compile(r'(\d{1,2})[._/](\d{1,2})[._/](\d{4})')
+_WORD_DATE = re.compile(r'(\d{1,2})\s+(' + '|'.join(MONTHS) + r')\s+(\d{4})', re.IGNORECASE)
+# Дата принятия в заголовке: "... от 22.07.2008 № 123-ФЗ", "... от 22 июля 2008 г."
+_TITLE_DATE = re.compile(r'\bот\s+(\d{1,2}[._/]\d{1,2}[._/]\d{4}|\d{1,2}\s+[а-яё]+\s+\d{4})', re.IGNORECASE)
+
+# Обозначения нормативных документов перед номером; длинные проверяются раньше коротких
+DESIGNATIONS = (
+    'ГОСТ Р ИСО', 'ГОСТ Р МЭК', 'ГОСТ Р', 'ГОСТ ISO', 'ГОСТ IEC', 'ГОСТ', 'ТР ТС', 'ТР ЕАЭС',
+    'СанПиН', 'СНиП', 'СП', 'НПБ', 'ППБ', 'ВСН', 'МДС', 'РД', 'СО',
+)
+_DESIGNATION_NAMES = {designation.upper(): designation for designation in DESIGNATIONS}
+_DESIGNATED = re.compile(
+    r'(?<!\w)(' + '|'.join(re.escape(designation).replace(r'\ ', r'\s+') for designation in DESIGNATIONS) + r')'
+    r'\s+(\d[\w.\-/]*)',
+    re.IGNORECASE
+)
+# Вид акта после номера через дефис: 123-ФЗ, 390-П
+_ACT_SUFFIX = re.compile(r'^(\d[\w.\-/]*?)-([А-ЯЁA-Z]{1,6})$')
+_EXPLICIT_NUMBER = re.compile(r'[№N]\s*(\d[\w.\-/]*)')
+# Номер акта без знака номера: "Федеральный закон 123-ФЗ"
+_ACT_NUMBER = re.compile(r'(?<![\w.\-/])\d[\d.]*-[А-ЯЁA-Z]{1,6}(?!\w)')
+# Номер без обозначения: с цифры, части могут разделяться пробелами вокруг - . /
+_NUMBER = re.compile(r'\d[\w.\-/]*(?:\s*[.\-/]\s*\w[\w.\-/]*)*')
+_DASHES = re.compile(r'[‐-―−]')
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """Дата из строки вида 22.07.2008, 22_07_2008, 2008-07-22 или 22 июля 2008 г."""
+    if not value:
+        return None
+    try:
+        match = _ISO_DATE.search(value)
+        if match:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        match = _NUMERIC_DATE.search(value)
+        if match:
+            return date(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+        match = _WORD_DATE.search(value)
+        if match:
+            return date(int(match.group(3)), MONTHS[match.group(2).lower()], int(match.group(1)))
+    except ValueError:
+        # 31.02.2020 и подобные опечатки
+        return None
+    return None
+
+
+def published_date(date_published: Optional[str], title: Optional[str] = None) -> Optional[date]:
+    """Дата принятия документа: из поля даты со страницы списка, иначе из заголовка -
+    после "от", а без него первая дата в заголовке"""
+    parsed = parse_date(date_published)
+    if parsed is None and title:
+        match = _TITLE_DATE.search(title)
+        parsed = parse_date(match.group(1) if match else title)
+    return parsed
+
+
+def split_number(value: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Обозначение (орган или вид документа) и канонический номер без него:
+    'ГОСТ Р 53325-2012' -> ('ГОСТ Р', '53325-2012'), '123-фз' -> ('ФЗ', '123'), '№ 645' -> (None, '645').
+
+    Слова перед номером, кроме известных обозначений, отбрасываются: 'Приказ МЧС 645' -> (None, '645')
+    """
+    if not value:
+        return None, None
+    value = _DASHES.sub('-', value).strip().upper()
+    value = re.sub(r'^[№N]\s*', '', value)
+
+    prefix = None
+    match = _DESIGNATED.match(value)
+    if match:
+        prefix = _DESIGNATION_NAMES[re.sub(r'\s+', ' ', match.group(1))]
+        value = match.group(2)
+    else:
+        match = _NUMBER.search(value)
+        if match:
+            value = match.group(0)
+    number = re.sub(r'\s+', '', value).rstrip('.-/')
+    if prefix is None:
+        match = _ACT_SUFFIX.match(number)
+        if match:
+            number, prefix = match.group(1), match.group(2)
+    return prefix, number or None
+
+
+def document_number(number: Optional[str], title: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """Обозначение и номер документа: из поля номера со страницы списка, иначе из заголовка"""
+    if number:
+        return split_number(number)
+    if title:
+        title = _DASHES.sub('-', title)
+        match = _DESIGNATED.search(title) or _EXPLICIT_NUMBER.search(title) or _ACT_NUMBER.search(title)
+        if match:
+            return split_number(match.group(0))
+    return None, None
+
+
+def format_number(prefix: Optional[str], number: Optional[str]) -> Optional[str]:
+    """Номер для показа из результата split_number: ('ГОСТ Р', '53325-2012') -> 'ГОСТ Р 53325-2012',
+    ('ФЗ', '123') -> '123-ФЗ'"""
+    if number is None or prefix is None:
+        return number
+    return f'{prefix} {number}' if prefix in _DESIGNATION_NAMES.values() else f'{number}-{prefix}'
+
+
+def document_fields(title: Optional[str], date_published: Optional[str], number: Optional[str]) -> Dict:
+    """Типизированные колонки documents: published_on, number_prefix, number_key"""
+    prefix, key = document_number(number, title)
+    return {
+        'published_on': published_date(date_published, title),
+        'number_prefix': prefix,
+        'number_key': key,
+    }
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Заголовок запроса, который включает профилирование конкретного вызова
+PROFILE_HEADER = b'x-profile'
+# Заголовок ответа с идентификатором сохраненного профиля
+PROFILE_ID_HEADER = b'x-profile-id'
+PROFILE_SUFFIX = '.collapsed'
+MAX_STACK_DEPTH = 128
+
+_PROFILE_ID = re.compile(r'^[A-Za-z0-9.-]+$')
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame) -> List[str]:
+    """Стек потока от корня к текущей функции"""
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_stack(task: asyncio.Task) -> List[str]:
+    """Цепочка await задачи от обработчика к месту, где она сейчас ждет"""
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(stack) < MAX_STACK_DEPTH:
+        frame = (getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+                 or getattr(awaitable, 'ag_frame', None))
+        if frame is not None:
+            stack.append(_label(frame.f_code))
+        awaitable = (getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+                     or getattr(awaitable, 'ag_await', None))
+    return stack
+
+
+def _is_leaf(frame, name: str, filename: str) -> bool:
+    return frame.f_code.co_name == name and frame.f_code.co_filename.endswith(filename)
+
+
+def _is_idle_worker(frame) -> bool:
+    """Поток пула ждет следующую задачу: в concurrent.futures или в очереди queue (AnyIO)"""
+    if _is_leaf(frame, '_worker', os.path.join('concurrent', 'futures', 'thread.py')):
+        return True
+    for _ in range(3):
+        if frame is None:
+            return False
+        if _is_leaf(frame, 'get', 'queue.py'):
+            return True
+        frame = frame.f_back
+    return False
+
+
+class Profile:
+    """Сэмплы одного запроса: стек -> число попаданий"""
+
+    def __init__(self, method: str, path: str, task: asyncio.Task):
+        self.method = method
+        self.path = path
+        self.task = task
+        self.thread_id = threading.get_ident()
+        self.created = time.time()
+        self.stacks: Counter = Counter()
+        self.id = None
+
+
+class Profiler:
+    """Выборочное профилирование запросов по настенному времени.
+
+    Пока идет хотя бы один профилируемый запрос, фоновый поток раз в interval секунд
+    снимает стеки всех потоков. Цикл событий относится к запросу: если он занят, берется
+    его стек, если ждет ввода-вывода - цепочка await задачи запроса, а также задач из
+    background (общих загрузок SingleFlight, которые запрос ждет). Занятые потоки пулов
+    (разбор HTML, HTTP-кэш, потоковая отдача) и фоновые задачи добавляются ко всем идущим
+    профилям, так как их работу нельзя точно приписать одному запросу.
+
+    Профили сохраняются в каталог в формате collapsed stacks (его читают speedscope
+    и flamegraph.pl); хранится не больше keep последних файлов.
+    """
+
+    def __init__(self, directory: str, keep: int = 50, interval: float = 0.005, rate: float = 0.0,
+                 background: Optional[Callable[[], Iterable[asyncio.Task]]] = None):
+        self.directory = directory
+        self.keep = keep
+        self.interval = interval
+        self.rate = rate
+        self.background = background
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Держится, пока идет снятие сэмплов, чтобы профиль не дописывался во время сохранения
+        self._sample_lock = threading.Lock()
+        self._active: List[Profile] = []
+        self._wakeup = threading.Event()
+        self._sequence = 0
+        self._thread = threading.Thread(target=self._run, name='meganorm-profiler', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, background: Optional[Callable[[], Iterable[asyncio.Task]]] = None) -> Optional['Profiler']:
+        """Профилировщик по настройкам окружения или None, если MEGANORM_PROFILE не равен 1.
+
+        Профилируются запросы с заголовком X-Profile: 1 и доля MEGANORM_PROFILE_RATE
+        остальных; MEGANORM_PROFILE_DIR, MEGANORM_PROFILE_KEEP и MEGANORM_PROFILE_INTERVAL_MS
+        задают каталог, число хранимых профилей и период сэмплирования.
+        """
+        if os.getenv("MEGANORM_PROFILE") != "1":
+            return None
+        return cls(
+            directory=os.getenv("MEGANORM_PROFILE_DIR", "profiles"),
+            keep=int(os.getenv("MEGANORM_PROFILE_KEEP", "50")),
+            interval=float(os.getenv("MEGANORM_PROFILE_INTERVAL_MS", "5")) / 1000,
+            rate=float(os.getenv("MEGANORM_PROFILE_RATE", "0")),
+            background=background
+        )
+
+    def wants(self, headers: List) -> bool:
+        if any(name == PROFILE_HEADER and value not in (b'', b'0') for name, value in headers):
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+    def start(self, method: str, path: str) -> Profile:
+        profile = Profile(method, path, asyncio.current_task())
+        with self._lock:
+            self._sequence += 1
+            slug = re.sub(r'[^A-Za-z0-9]+', '-', path).strip('-')[:60] or 'root'
+            profile.id = f"{int(profile.created * 1000)}-{self._sequence}-{method}-{slug}"
+            self._active.append(profile)
+            self._wakeup.set()
+        return profile
+
+    def stop(self, profile: Profile) -> None:
+        """Останавливает сэмплирование запроса и сохраняет профиль"""
+        with self._lock:
+            self._active.remove(profile)
+        with self._sample_lock:
+            pass
+        lines = [f"{stack} {count}" for stack, count in profile.stacks.most_common()]
+        with open(self._path(profile.id), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n' if lines else '')
+        self._prune()
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, profile_id + PROFILE_SUFFIX)
+
+    def _files(self) -> List[str]:
+        # Имя файла начинается с времени создания в миллисекундах
+        names = [name for name in os.listdir(self.directory) if name.endswith(PROFILE_SUFFIX)]
+        return sorted(names, key=lambda name: tuple(int(part) for part in name.split('-', 2)[:2]))
+
+    def _prune(self) -> None:
+        files = self._files()
+        for name in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def get_profiles(self) -> List[Dict]:
+        """Сохраненные профили, новые первыми"""
+        profiles = []
+        for name in reversed(self._files()):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    samples = sum(int(line.rsplit(' ', 1)[1]) for line in f if line.strip())
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            profile_id = name[:-len(PROFILE_SUFFIX)]
+            created_ms, _, method, path_slug = profile_id.split('-', 3)
+            profiles.append({
+                'id': profile_id,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(created_ms) / 1000)),
+                # Файл записывается по окончании запроса
+                'duration_ms': max(0, round(stat.st_mtime * 1000) - int(created_ms)),
+                'method': method,
+                'path': path_slug,
+                'samples': samples,
+                'size': stat.st_size,
+            })
+        return profiles
+
+    def file(self, profile_id: str) -> Optional[str]:
+        """Путь к файлу профиля или None, если такого профиля нет"""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = self._path(profile_id)
+        return path if os.path.exists(path) else None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                profiles = list(self._active)
+                if not profiles:
+                    self._wakeup.clear()
+                    continue
+            with self._sample_lock:
+                self._sample(profiles, own_id)
+            time.sleep(self.interval)
+
+    def _sample(self, profiles: List[Profile], own_id: int) -> None:
+        frames = sys._current_frames()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        loop_threads = {profile.thread_id for profile in profiles}
+
+        # Занятые потоки пулов; простаивающие рабочие потоки пропускаются
+        shared = []
+        for thread_id, frame in frames.items():
+            if thread_id == own_id or thread_id in loop_threads or _is_idle_worker(frame):
+                continue
+            shared.append(';'.join([names.get(thread_id, str(thread_id))] + _thread_stack(frame)))
+
+        # Фоновые задачи видны, только пока цикл событий простаивает
+        background = [
+            ';'.join(['background'] + _await_stack(task))
+            for task in (list(self.background()) if self.background else [])
+        ]
+
+        for profile in profiles:
+            frame = frames.get(profile.thread_id)
+            if frame is not None and not _is_leaf(frame, 'select', 'selectors.py'):
+                profile.stacks[';'.join(['event-loop'] + _thread_stack(frame))] += 1
+            else:
+                profile.stacks[';'.join(['await'] + _await_stack(profile.task))] += 1
+                for background_stack in background:
+                    profile.stacks[background_stack] += 1
+            for shared_stack in shared:
+                profile.stacks[shared_stack] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI-прослойка: профилирует выбранные запросы и возвращает X-Profile-Id"""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith('/profiles') \
+                or not self.profiler.wants(scope['headers']):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(scope['method'], scope['path'])
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(PROFILE_ID_HEADER, profile.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            await asyncio.to_thread(self.profiler.stop, profile)
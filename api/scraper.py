@@ -1,66 +1,276 @@
 import requests
+import httpx
 from bs4 import BeautifulSoup
 import re
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, AsyncIterator, Tuple
+import asyncio
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
 import logging
+from .links import extract_links
+from .http_cache import HttpCache, CachingAdapter, CachingTransport
+from .concurrency import (
+    HostBudget, PoliteAdapter, PoliteTransport, UpstreamError, default_budget, is_upstream_failure,
+    aiter_completed
+)
+from .type_registry import TypeRegistry, default_type_registry
+from .upstream import CircuitBreaker, default_breaker
+from .metrics import PARSE_QUEUE, STAGE_SECONDS, stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BASE_URL = "https://meganorm.ru"
+TYPES_PATH = "/mega_doc/fire/fire.html"
+# Заголовки разделов документа, от главы к статье
+SECTION_TAGS = ['h2', 'h3', 'h4']
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+def _find_line(text: str, lines: str, position: int) -> int:
+    """Позиция lines в text не раньше position, где lines занимает целые строки; -1, если нет"""
+    start = text.find(lines, position)
+    while start >= 0:
+        end = start + len(lines)
+        if (start == 0 or text[start - 1] == '\n') and (end == len(text) or text[end] == '\n'):
+            return start
+        start = text.find(lines, start + 1)
+    return -1
+
+
+class BaseMeganormScraper:
+    """Общая часть скраперов: адреса страниц и разбор HTML без сетевых запросов"""
+
+    def __init__(self, base_url: str = BASE_URL, types: TypeRegistry = default_type_registry,
+                 breaker: CircuitBreaker = default_breaker):
+        self.base_url = base_url
+        self.types_url = urljoin(base_url, TYPES_PATH)
+        # Типы документов общие для всех скраперов процесса и не загружаются повторно до истечения TTL
+        self.types = types
+        # Пока сайт не отвечает, загрузки сразу завершаются ошибкой, не дожидаясь таймаутов
+        self.breaker = breaker
+        self.headers = {'User-Agent': USER_AGENT}
+
+    def listing_url(self, type_url: str, page: int) -> str:
+        """URL страницы списка документов с учетом номера страницы"""
+        # Если это не первая страница, добавляем номер страницы к URL
+        if page > 0:
+            if type_url.endswith('.html'):
+                return type_url.replace('.html', f'_{page}.html')
+            return f"{type_url}_{page}.html"
+        return type_url
+
+    @stage('extract')
+    def _parse_document_types(self, content: bytes) -> List[Dict[str, str]]:
+        document_types = []
+
+        # Ищем все ссылки на типы документов
+        for href, text in extract_links(content):
+            # Фильтруем ссылки на типы документов
+            if href and '/mega_doc/fire/' in href and text:
+                # Исключаем ссылки на конкретные документы
+                if not any(x in href.lower() for x in ['#', '.html#', 'zakon/0/', 'gost/0/']):
+                    if any(keyword in text.lower() for keyword in [
+                        'закон', 'постановление', 'гост', 'снип', 'правила',
+                        'требования', 'инструкция', 'стандарт', 'норма'
+                    ]):
+                        full_url = urljoin(self.base_url, href)
+                        document_types.append({
+                            'name': text,
+                            'url': full_url
+                        })
 
-class MeganormScraper:
-    def __init__(self):
-        self.base_url = "https://meganorm.ru"
+        # Удаляем дубликаты
+        seen = set()
+        unique_types = []
+        for doc_type in document_types:
+            if doc_type['url'] not in seen:
+                seen.add(doc_type['url'])
+                unique_types.append(doc_type)
+
+        logger.info(f"Найдено {len(unique_types)} типов документов")
+        return unique_types
+
+    @stage('extract')
+    def _parse_documents(self, content: bytes, page: int) -> List[Dict[str, str]]:
+        documents = []
+
+        # Ищем ссылки на документы
+        for href, text in extract_links(content):
+            if href and text and len(text) > 10:
+                # Проверяем, что это ссылка на документ
+                if '/zakon/0/' in href or '/gost/0/' in href or 'postanovlenie' in href.lower():
+                    full_url = urljoin(self.base_url, href)
+
+                    # Извлекаем дату и номер из названия
+                    date_match = re.search(r'от\s+(\d{2}[\._]\d{2}[\._]\d{4})', text)
+                    number_match = re.search(r'[№N]\s*(\d+[-\w]*)', text)
+
+                    documents.append({
+                        'title': text,
+                        'url': full_url,
+                        'date_published': date_match.group(1).replace('_', '.') if date_match else None,
+                        'number': number_match.group(1) if number_match else None
+                    })
+
+        logger.info(f"Найдено {len(documents)} документов на странице {page}")
+        return documents
+
+    def _parse_document_content(self, content: bytes) -> Dict[str, any]:
+        with stage('parse'):
+            soup = BeautifulSoup(content, 'html.parser')
+        with stage('extract'):
+            return self._extract_document_content(soup)
+
+    def _extract_document_content(self, soup: BeautifulSoup) -> Dict[str, any]:
+        # Извлекаем заголовок
+        title = ""
+        title_elem = soup.find('h1') or soup.find('title')
+        if title_elem:
+            title = title_elem.get_text(strip=True)
+
+        # Извлекаем основной контент
+        text = ""
+        content_div = soup.find('div', class_='content') or soup.find('div', id='content')
+
+        if not content_div:
+            # Если не найден основной контент, берем весь текст body
+            content_div = soup.find('body')
+
+        if content_div:
+            # Удаляем скрипты и стили
+            for script in content_div(["script", "style"]):
+                script.decompose()
+
+            text = content_div.get_text(separator='\n', strip=True)
+
+        # Извлекаем разделы/главы
+        sections = []
+        section_headers = soup.find_all(SECTION_TAGS)
+        for header in section_headers:
+            section_text = header.get_text(strip=True)
+            if section_text and len(section_text) > 3:
+                sections.append(section_text)
+
+        return {
+            'title': title,
+            'content': text,
+            'sections': sections[:20],  # Ограничиваем количество разделов
+            'outline': self._build_outline(content_div, text, title) if content_div else []
+        }
+
+    def _build_outline(self, content_div, text: str, title: str) -> List[Dict]:
+        """Оглавление текста по заголовкам h2-h4 с границами разделов [start, end) в символах.
+
+        Нулевой раздел - весь документ; раздел продолжается до следующего заголовка
+        того же или более высокого уровня, то есть включает свои подразделы.
+        """
+        outline = [{'level': 1, 'heading': title, 'parent': None, 'start': 0, 'end': len(text)}]
+        # Разделы, которые еще не закончились, от внешнего к внутреннему
+        open_sections = [0]
+        position = 0
+        for header in content_div.find_all(SECTION_TAGS):
+            lines = header.get_text(separator='\n', strip=True)
+            start = _find_line(text, lines, position) if lines else -1
+            if start < 0:
+                continue
+            level = int(header.name[1])
+            while outline[open_sections[-1]]['level'] >= level:
+                # Перевод строки перед заголовком не входит в предыдущий раздел
+                closed = outline[open_sections.pop()]
+                closed['end'] = max(closed['start'], start - 1)
+            outline.append({
+                'level': level,
+                'heading': header.get_text(separator=' ', strip=True),
+                'parent': open_sections[-1],
+                'start': start,
+                'end': len(text)
+            })
+            open_sections.append(len(outline) - 1)
+            position = start + len(lines)
+        return outline
+
+    def _filter_documents(self, documents: List[Dict[str, str]], query: str,
+                          doc_type_name: str) -> List[Dict[str, str]]:
+        """Отбирает документы, в названии которых встречается запрос"""
+        matched = []
+        for doc in documents:
+            if query.lower() in doc['title'].lower():
+                doc['doc_type'] = doc_type_name
+                matched.append(doc)
+        return matched
+
+    def _search_plan(self, doc_type: Optional[str]) -> List[Dict]:
+        """Типы для обхода при поиске: skip - сколько найденных документов типа уже отдано"""
+        return [{'url': type_data['url'], 'name': type_data['name'], 'skip': 0}
+                for type_data in self.types.match(doc_type)]
+
+    @staticmethod
+    def _take_matches(item: Dict, matched: List[Dict], found: List[Dict], limit: Optional[int]) -> bool:
+        """Добавляет в found еще не отданные документы типа; True, если тип исчерпан"""
+        for doc in matched[item['skip']:]:
+            if limit and len(found) >= limit:
+                return False
+            found.append(doc)
+            item['skip'] += 1
+        return True
+
+
+class MeganormScraper(BaseMeganormScraper):
+    def __init__(self, cache: Optional[HttpCache] = None, budget: HostBudget = default_budget,
+                 search_concurrency: int = 8, base_url: str = BASE_URL,
+                 types: TypeRegistry = default_type_registry, breaker: CircuitBreaker = default_breaker):
+        super().__init__(base_url, types, breaker)
+        self.search_concurrency = search_concurrency
         self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.session.headers.update(self.headers)
+
+        # Сетевые запросы соблюдают бюджет вежливости хоста
+        adapter = PoliteAdapter(budget)
+
+        # Страницы кэшируются на диске под сессией; без явного кэша берется кэш из настроек окружения
+        self.cache = cache or HttpCache.from_env()
+        if self.cache:
+            adapter = CachingAdapter(self.cache, adapter)
+
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _fetch(self, url: str, timeout: float, revalidate: bool = False) -> bytes:
+        """Загружает страницу; ошибку сайта после всех повторов превращает в UpstreamError.
+
+        revalidate - проверить страницу на сайте, даже если в HTTP-кэше она еще свежая.
+        """
+        self.breaker.before_request(url)
+        headers = {'Cache-Control': 'no-cache'} if revalidate else None
+        try:
+            with stage('fetch'):
+                response = self.session.get(url, timeout=timeout, headers=headers)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            self.breaker.record_failure(url)
+            raise UpstreamError(f"{url}: {e}") from e
+        if is_upstream_failure(response.status_code):
+            self.breaker.record_failure(url)
+            raise UpstreamError(f"{url}: HTTP {response.status_code}")
+        self.breaker.record_success(url)
+        response.raise_for_status()
+        return response.content
 
     def get_document_types(self) -> List[Dict[str, str]]:
         """Извлекает все типы документов с главной страницы"""
-        url = "https://meganorm.ru/mega_doc/fire/fire.html"
+        cached = self.types.get()
+        if cached is not None:
+            return cached
 
         try:
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            document_types = []
-
-            # Ищем все ссылки на типы документов
-            links = soup.find_all('a', href=True)
-
-            for link in links:
-                href = link.get('href')
-                text = link.get_text(strip=True)
-
-                # Фильтруем ссылки на типы документов
-                if href and '/mega_doc/fire/' in href and text:
-                    # Исключаем ссылки на конкретные документы
-                    if not any(x in href.lower() for x in ['#', '.html#', 'zakon/0/', 'gost/0/']):
-                        if any(keyword in text.lower() for keyword in [
-                            'закон', 'постановление', 'гост', 'снип', 'правила',
-                            'требования', 'инструкция', 'стандарт', 'норма'
-                        ]):
-                            full_url = urljoin(self.base_url, href)
-                            document_types.append({
-                                'name': text,
-                                'url': full_url
-                            })
-
-            # Удаляем дубликаты
-            seen = set()
-            unique_types = []
-            for doc_type in document_types:
-                if doc_type['url'] not in seen:
-                    seen.add(doc_type['url'])
-                    unique_types.append(doc_type)
-
-            logger.info(f"Найдено {len(unique_types)} типов документов")
-            return unique_types
+            types_data = self._parse_document_types(self._fetch(self.types_url, timeout=10))
+            self.types.set(types_data)
+            return types_data
 
+        except UpstreamError:
+            # Недоступность сайта - не пустой результат, решение оставляем вызывающему
+            raise
         except Exception as e:
             logger.error(f"Ошибка при получении типов документов: {e}")
             return []
@@ -68,112 +278,246 @@ class MeganormScraper:
     def get_documents_by_type(self, type_url: str, page: int = 0) -> List[Dict[str, str]]:
         """Извлекает список документов определенного типа"""
         try:
-            # Если это не первая страница, добавляем номер страницы к URL
-            if page > 0:
-                if type_url.endswith('.html'):
-                    type_url = type_url.replace('.html', f'_{page}.html')
-                else:
-                    type_url = f"{type_url}_{page}.html"
-
-            response = self.session.get(type_url, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
+            return self._parse_documents(self._fetch(self.listing_url(type_url, page), timeout=10), page)
 
-            documents = []
-
-            # Ищем ссылки на документы
-            links = soup.find_all('a', href=True)
+        except UpstreamError:
+            # Недоступность сайта - не пустой результат, решение оставляем вызывающему
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении документов: {e}")
+            return []
 
-            for link in links:
-                href = link.get('href')
-                text = link.get_text(strip=True)
+    def get_document_content(self, document_url: str, revalidate: bool = False) -> Dict[str, any]:
+        """Извлекает полное содержимое документа; revalidate - в обход свежей записи HTTP-кэша"""
+        try:
+            return self._parse_document_content(self._fetch(document_url, timeout=15, revalidate=revalidate))
 
-                if href and text and len(text) > 10:
-                    # Проверяем, что это ссылка на документ
-                    if '/zakon/0/' in href or '/gost/0/' in href or 'postanovlenie' in href.lower():
-                        full_url = urljoin(self.base_url, href)
+        except UpstreamError:
+            # Недоступность сайта - не пустой результат, решение оставляем вызывающему
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении содержимого документа {document_url}: {e}")
+            return {'title': '', 'content': '', 'sections': [], 'outline': []}
+
+
+class AsyncMeganormScraper(BaseMeganormScraper):
+    """Асинхронный скрапер на общем пуле keep-alive соединений httpx.
+
+    Число одновременных запросов к meganorm.ru ограничено max_connections,
+    разбор HTML выполняется в отдельном пуле потоков, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0, parse_workers: int = 2,
+                 cache: Optional[HttpCache] = None, budget: HostBudget = default_budget,
+                 search_concurrency: int = 8, base_url: str = BASE_URL,
+                 types: TypeRegistry = default_type_registry, breaker: CircuitBreaker = default_breaker):
+        super().__init__(base_url, types, breaker)
+        self.search_concurrency = search_concurrency
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+
+        # Сетевые запросы соблюдают бюджет вежливости хоста
+        transport = PoliteTransport(transport, budget)
+
+        # Страницы кэшируются на диске под клиентом; без явного кэша берется кэш из настроек окружения
+        self.cache = cache or HttpCache.from_env()
+        if self.cache:
+            transport = CachingTransport(self.cache, transport)
+
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            transport=transport,
+            follow_redirects=True
+        )
+        self.parse_executor = ThreadPoolExecutor(max_workers=parse_workers)
+
+    async def _fetch(self, url: str, timeout: float, revalidate: bool = False) -> bytes:
+        """Загружает страницу; ошибку сайта после всех повторов превращает в UpstreamError.
+
+        revalidate - проверить страницу на сайте, даже если в HTTP-кэше она еще свежая.
+        """
+        self.breaker.before_request(url)
+        headers = {'Cache-Control': 'no-cache'} if revalidate else None
+        try:
+            with stage('fetch'):
+                response = await self.client.get(url, timeout=timeout, headers=headers)
+        except httpx.TransportError as e:
+            self.breaker.record_failure(url)
+            raise UpstreamError(f"{url}: {e!r}") from e
+        if is_upstream_failure(response.status_code):
+            self.breaker.record_failure(url)
+            raise UpstreamError(f"{url}: HTTP {response.status_code}")
+        self.breaker.record_success(url)
+        response.raise_for_status()
+        return response.content
+
+    async def _parse(self, func, *args):
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+
+        def run():
+            STAGE_SECONDS.observe(time.perf_counter() - submitted, 'parse_queue')
+            return func(*args)
+
+        PARSE_QUEUE.inc()
+        try:
+            return await loop.run_in_executor(self.parse_executor, run)
+        finally:
+            PARSE_QUEUE.dec()
 
-                        # Извлекаем дату и номер из названия
-                        date_match = re.search(r'от\s+(\d{2}[\._]\d{2}[\._]\d{4})', text)
-                        number_match = re.search(r'[№N]\s*(\d+[-\w]*)', text)
+    async def get_document_types(self) -> List[Dict[str, str]]:
+        """Извлекает все типы документов с главной страницы"""
+        cached = self.types.get()
+        if cached is not None:
+            return cached
 
-                        documents.append({
-                            'title': text,
-                            'url': full_url,
-                            'date_published': date_match.group(1).replace('_', '.') if date_match else None,
-                            'number': number_match.group(1) if number_match else None
-                        })
+        try:
+            content = await self._fetch(self.types_url, timeout=10)
+            types_data = await self._parse(self._parse_document_types, content)
+            self.types.set(types_data)
+            return types_data
+
+        except UpstreamError:
+            # Недоступность сайта - не пустой результат, решение оставляем вызывающему
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении типов документов: {e}")
+            return []
 
-            logger.info(f"Найдено {len(documents)} документов на странице {page}")
-            return documents
+    async def get_documents_by_type(self, type_url: str, page: int = 0) -> List[Dict[str, str]]:
+        """Извлекает список документов определенного типа"""
+        try:
+            content = await self._fetch(self.listing_url(type_url, page), timeout=10)
+            return await self._parse(self._parse_documents, content, page)
 
+        except UpstreamError:
+            # Недоступность сайта - не пустой результат, решение оставляем вызывающему
+            raise
         except Exception as e:
             logger.error(f"Ошибка при получении документов: {e}")
             return []
 
-    def get_document_content(self, document_url: str) -> Dict[str, any]:
-        """Извлекает полное содержимое документа"""
+    async def get_document_content(self, document_url: str, revalidate: bool = False) -> Dict[str, any]:
+        """Извлекает полное содержимое документа; revalidate - в обход свежей записи HTTP-кэша"""
         try:
-            response = self.session.get(document_url, timeout=15)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Извлекаем заголовок
-            title = ""
-            title_elem = soup.find('h1') or soup.find('title')
-            if title_elem:
-                title = title_elem.get_text(strip=True)
-
-            # Извлекаем основной контент
-            content = ""
-            content_div = soup.find('div', class_='content') or soup.find('div', id='content')
-
-            if not content_div:
-                # Если не найден основной контент, берем весь текст body
-                content_div = soup.find('body')
-
-            if content_div:
-                # Удаляем скрипты и стили
-                for script in content_div(["script", "style"]):
-                    script.decompose()
-
-                content = content_div.get_text(separator='\n', strip=True)
-
-            # Извлекаем разделы/главы
-            sections = []
-            section_headers = soup.find_all(['h2', 'h3', 'h4'])
-            for header in section_headers:
-                section_text = header.get_text(strip=True)
-                if section_text and len(section_text) > 3:
-                    sections.append(section_text)
-
-            return {
-                'title': title,
-                'content': content,
-                'sections': sections[:20]  # Ограничиваем количество разделов
-            }
+            content = await self._fetch(document_url, timeout=15, revalidate=revalidate)
+            return await self._parse(self._parse_document_content, content)
 
+        except UpstreamError:
+            # Недоступность сайта - не пустой результат, решение оставляем вызывающему
+            raise
         except Exception as e:
             logger.error(f"Ошибка при получении содержимого документа {document_url}: {e}")
-            return {'title': '', 'content': '', 'sections': []}
+            return {'title': '', 'content': '', 'sections': [], 'outline': []}
 
-    def search_documents(self, query: str, doc_type: str = None) -> List[Dict[str, str]]:
-        """Поиск документов по запросу"""
-        all_documents = []
-
-        # Получаем типы документов
-        document_types = self.get_document_types()
-
-        for doc_type_info in document_types:
-            if doc_type and doc_type.lower() not in doc_type_info['name'].lower():
-                continue
-
-            documents = self.get_documents_by_type(doc_type_info['url'])
+    async def iter_search_documents(self, query: str, doc_type: str = None,
+                                    limit: Optional[int] = None) -> AsyncIterator[Dict[str, str]]:
+        """Поиск документов по запросу; найденные документы отдаются по мере загрузки списков.
 
+        Списки типов загружаются параллельно (не больше search_concurrency одновременно),
+        после limit найденных документов оставшиеся загрузки отменяются.
+        """
+        # Получаем типы документов: список обновляется, только если устарел
+        try:
+            await self.get_document_types()
+        except UpstreamError as e:
+            # Пока сайт недоступен, ищем по известному, пусть и устаревшему, списку типов
+            if not self.types.match():
+                raise
+            logger.warning(f"Поиск по устаревшему списку типов: {e}")
+        document_types = self.types.match(doc_type)
+
+        async def search_type(doc_type_info):
+            try:
+                documents = await self.get_documents_by_type(doc_type_info['url'])
+            except UpstreamError as e:
+                # Результаты поиска не сохраняются, поэтому недоступный список просто пропускаем
+                logger.warning(f"Список {doc_type_info['name']} пропущен: {e}")
+                return []
             # Фильтруем по запросу
-            for doc in documents:
-                if query.lower() in doc['title'].lower():
-                    doc['doc_type'] = doc_type_info['name']
-                    all_documents.append(doc)
+            return self._filter_documents(documents, query, doc_type_info['name'])
 
-        return all_documents
\ No newline at end of file
+        found = 0
+        results = aiter_completed(search_type, document_types, self.search_concurrency)
+        try:
+            async for documents in results:
+                for doc in documents:
+                    yield doc
+                    found += 1
+                    if limit and found >= limit:
+                        return
+        finally:
+            await results.aclose()
+
+    async def search_documents(self, query: str, doc_type: str = None,
+                               limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """Поиск документов по запросу"""
+        return [doc async for doc in self.iter_search_documents(query, doc_type, limit)]
+
+    async def search_documents_until(self, query: str, doc_type: str = None, limit: Optional[int] = None,
+                                     timeout: Optional[float] = None,
+                                     pending: Optional[List[Dict]] = None) -> Tuple[List[Dict], List[Dict], bool]:
+        """Поиск с ограничением по времени, который можно продолжить.
+
+        pending - недообойденные типы из предыдущего вызова; без него обходятся все типы doc_type.
+        Возвращает найденные документы, недообойденные типы (пусто, если обход закончен)
+        и признак того, что обход остановлен по истечении timeout секунд.
+        """
+        # Срок отсчитывается от начала вызова, включая загрузку списка типов
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(0.0, deadline - loop.time())
+
+        if pending is None:
+            try:
+                await asyncio.wait_for(self.get_document_types(), remaining())
+            except asyncio.TimeoutError:
+                # Типы не успели загрузиться: продолжение обойдет все уже известные типы
+                return [], self._search_plan(doc_type), True
+            except UpstreamError as e:
+                if not self.types.match():
+                    raise
+                logger.warning(f"Поиск по устаревшему списку типов: {e}")
+            pending = self._search_plan(doc_type)
+
+        async def search_type(entry):
+            index, item = entry
+            try:
+                documents = await self.get_documents_by_type(item['url'])
+            except UpstreamError as e:
+                logger.warning(f"Список {item['name']} пропущен: {e}")
+                return index, []
+            return index, self._filter_documents(documents, query, item['name'])
+
+        unfinished = {index: dict(item) for index, item in enumerate(pending)}
+        found = []
+        timed_out = False
+        results = aiter_completed(search_type, list(unfinished.items()), self.search_concurrency)
+        try:
+            while not (limit and len(found) >= limit):
+                try:
+                    # По таймауту ожидание отменяется, а вместе с ним и все незавершенные загрузки
+                    index, matched = await asyncio.wait_for(results.__anext__(), remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    break
+                if self._take_matches(unfinished[index], matched, found, limit):
+                    del unfinished[index]
+        finally:
+            await results.aclose()
+        return found, [unfinished[index] for index in sorted(unfinished)], timed_out
+
+    async def aclose(self):
+        """Закрывает пул соединений и пул потоков разбора"""
+        await self.client.aclose()
+        self.parse_executor.shutdown(wait=False)
@@ -0,0 +1,503 @@
+import base64
+import binascii
+import json
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+import snowballstemmer
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from .compression import decompress_text
+from .normalize import split_number
+
+SEARCH_MODES = ('exact', 'stemmed', 'fuzzy')
+
+# Поисковые индексы FTS5 над документами:
+#   documents_fts     - слова заголовка и текста как есть (режим exact);
+#   documents_stem    - основы слов после русского стеммера Snowball (режим stemmed),
+#                       таблица без собственного содержимого, хранит только индекс;
+#                       текст из основ считается при сохранении документа и хранится
+#                       сжатым в document_contents.stem_z, чтобы триггеры не запускали
+#                       стеммер, пока держат блокировку записи;
+#   documents_trigram - триграммы заголовка и номера для поиска с опечатками (режим fuzzy).
+# Текст документа хранится сжатым в document_contents, поэтому индексы по тексту строятся
+# по представлению documents_text, которое распаковывает его SQL-функцией meganorm_inflate.
+# Все индексы поддерживаются триггерами, поэтому обновляются при любой записи в documents
+# и document_contents. Функции meganorm_stem и meganorm_inflate регистрирует
+# register_sql_functions на каждом соединении движка.
+TEXT_VIEW_DDL = """
+    CREATE VIEW IF NOT EXISTS documents_text AS
+    SELECT d.id AS id, d.title AS title, meganorm_inflate(c.content_z) AS content
+    FROM documents d
+    LEFT JOIN document_contents c ON c.document_id = d.id
+"""
+
+SEARCH_INDEXES = {
+    'documents_fts': {
+        'ddl': """
+            CREATE VIRTUAL TABLE documents_fts USING fts5(
+                title, content,
+                content='documents_text', content_rowid='id',
+                tokenize='unicode61'
+            )
+        """,
+        'populate': "INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')",
+        'columns': ('title', 'content'),
+        'values': ("{}", "{}"),
+        'text': 'content_z',
+    },
+    'documents_stem': {
+        'ddl': """
+            CREATE VIRTUAL TABLE documents_stem USING fts5(
+                title, content,
+                content='',
+                tokenize='unicode61'
+            )
+        """,
+        'populate': """
+            INSERT INTO documents_stem(rowid, title, content)
+            SELECT d.id, meganorm_stem(d.title), meganorm_inflate(c.stem_z)
+            FROM documents d
+            LEFT JOIN document_contents c ON c.document_id = d.id
+        """,
+        'columns': ('title', 'content'),
+        'values': ("meganorm_stem({})", "{}"),
+        'text': 'stem_z',
+    },
+    'documents_trigram': {
+        'ddl': """
+            CREATE VIRTUAL TABLE documents_trigram USING fts5(
+                title, number,
+                content='documents', content_rowid='id',
+                tokenize='trigram'
+            )
+        """,
+        'populate': "INSERT INTO documents_trigram(documents_trigram) VALUES ('rebuild')",
+        'columns': ('title', 'number'),
+        'values': ("{}", "{}"),
+        'text': None,
+    },
+}
+
+# Триггеры индексов по колонкам самой таблицы documents
+TRIGGERS_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON documents BEGIN
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.id, {new});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON documents BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.id, {old});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {columns} ON documents BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.id, {old});
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.id, {new});
+    END
+    """,
+]
+
+# Триггеры индексов по тексту: заголовок меняется в documents, текст - в колонке
+# document_contents, указанной в 'text' индекса. Строка document_contents без документа в индекс не попадает,
+# поэтому результат не зависит от порядка вставки и удаления строк двух таблиц.
+TEXT_TRIGGERS_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON documents BEGIN
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.id, {doc_new});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON documents BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.id, {doc_old});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF title ON documents BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.id, {doc_old});
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.id, {doc_new});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_content_ai AFTER INSERT ON document_contents
+    WHEN EXISTS (SELECT 1 FROM documents WHERE id = new.document_id) BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', new.document_id, {content_new_empty});
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.document_id, {content_new});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_content_ad AFTER DELETE ON document_contents
+    WHEN EXISTS (SELECT 1 FROM documents WHERE id = old.document_id) BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.document_id, {content_old});
+        INSERT INTO {table}(rowid, {columns}) VALUES (old.document_id, {content_old_empty});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_content_au AFTER UPDATE OF {source} ON document_contents
+    WHEN EXISTS (SELECT 1 FROM documents WHERE id = new.document_id) BEGIN
+        INSERT INTO {table}({table}, rowid, {columns}) VALUES ('delete', old.document_id, {content_old});
+        INSERT INTO {table}(rowid, {columns}) VALUES (new.document_id, {content_new});
+    END
+    """,
+]
+
+# Веса колонок для bm25 и параметры ранжирования по режимам
+MODE_INDEXES = {
+    'exact': ('documents_fts', "10.0, 1.0"),
+    'stemmed': ('documents_stem', "10.0, 1.0"),
+    'fuzzy': ('documents_trigram', "1.0, 2.0"),
+}
+SNIPPET_TOKENS = 24
+
+# Без точного подсчета совпадения считаются только до ESTIMATE_LIMIT, точные
+# значения хранятся в кэше TOTAL_CACHE_TTL секунд
+ESTIMATE_LIMIT = 1000
+TOTAL_CACHE_TTL = 60.0
+TOTAL_CACHE_SIZE = 1024
+
+# Если в диапазон дат попадает не больше стольких документов, они перебираются по индексу
+# published_on с проверкой MATCH для каждого; для широкого диапазона дешевле идти от
+# полнотекстового индекса и отбрасывать документы с другой датой
+DATE_RANGE_SCAN_LIMIT = 50
+
+_totals: "OrderedDict[Tuple, Tuple[float, int]]" = OrderedDict()
+_totals_lock = threading.Lock()
+
+_stemmers = threading.local()
+
+
+def _stemmer():
+    # Экземпляры стеммера Snowball хранят состояние, поэтому у каждого потока свой
+    if not hasattr(_stemmers, 'russian'):
+        _stemmers.russian = snowballstemmer.stemmer('russian')
+    return _stemmers.russian
+
+
+# Слов в документах немного по сравнению с их употреблениями, поэтому основа каждого
+# слова считается один раз
+@lru_cache(maxsize=200_000)
+def _stem_word(word: str) -> str:
+    return _stemmer().stemWord(word)
+
+
+def stem_tokens(value: Optional[str]) -> List[str]:
+    """Разбивает текст на слова и приводит их к основам"""
+    if not value:
+        return []
+    return [_stem_word(word) for word in re.findall(r'\w+', value.lower())]
+
+
+def stem_text(value: Optional[str]) -> Optional[str]:
+    """Текст из основ слов для индекса documents_stem"""
+    if value is None:
+        return None
+    return " ".join(stem_tokens(value))
+
+
+def register_sql_functions(dbapi_connection, connection_record=None):
+    """Регистрирует SQL-функции, которые используются триггерами поисковых индексов"""
+    dbapi_connection.create_function("meganorm_stem", 1, stem_text, deterministic=True)
+    dbapi_connection.create_function("meganorm_inflate", 1, decompress_text, deterministic=True)
+
+
+def _values(index: Dict, *expressions: str) -> str:
+    return ", ".join(value.format(expression) for value, expression in zip(index['values'], expressions))
+
+
+def _triggers_ddl(table: str, index: Dict) -> List[str]:
+    columns = ", ".join(index['columns'])
+    if not index['text']:
+        return [ddl.format(
+            table=table, columns=columns,
+            old=_values(index, *('old.' + column for column in index['columns'])),
+            new=_values(index, *('new.' + column for column in index['columns'])),
+        ) for ddl in TRIGGERS_DDL]
+
+    source = index['text']
+
+    def content_of(doc_id):
+        return f"(SELECT meganorm_inflate({source}) FROM document_contents WHERE document_id = {doc_id})"
+
+    def title_of(doc_id):
+        return f"(SELECT title FROM documents WHERE id = {doc_id})"
+
+    return [ddl.format(
+        table=table, columns=columns, source=source,
+        doc_old=_values(index, 'old.title', content_of('old.id')),
+        doc_new=_values(index, 'new.title', content_of('new.id')),
+        content_old=_values(index, title_of('old.document_id'), f'meganorm_inflate(old.{source})'),
+        content_new=_values(index, title_of('new.document_id'), f'meganorm_inflate(new.{source})'),
+        content_old_empty=_values(index, title_of('old.document_id'), 'NULL'),
+        content_new_empty=_values(index, title_of('new.document_id'), 'NULL'),
+    ) for ddl in TEXT_TRIGGERS_DDL]
+
+
+def create_search_index(engine):
+    """Создает поисковые индексы и триггеры; новые индексы заполняет существующими документами"""
+    with engine.begin() as conn:
+        conn.execute(text(TEXT_VIEW_DDL))
+        for table, index in SEARCH_INDEXES.items():
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': table}
+            ).first()
+
+            if not exists:
+                conn.execute(text(index['ddl']))
+                conn.execute(text(index['populate']))
+
+            for ddl in _triggers_ddl(table, index):
+                conn.execute(text(ddl))
+
+
+def drop_text_indexes(conn, tables: Optional[Tuple[str, ...]] = None):
+    """Удаляет индексы по тексту документов (или только tables) вместе с триггерами,
+    чтобы построить их заново"""
+    for table, index in SEARCH_INDEXES.items():
+        if not index['text'] or (tables is not None and table not in tables):
+            continue
+        triggers = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars().all()
+        for trigger in triggers:
+            if trigger.startswith(table + '_'):
+                conn.execute(text(f"DROP TRIGGER {trigger}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+def _quote(token: str) -> str:
+    return '"%s"' % token.replace('"', '""')
+
+
+def build_match_query(q: str, mode: str = 'exact') -> Optional[str]:
+    """Преобразует пользовательский запрос в безопасное выражение MATCH для индекса режима"""
+    if mode == 'fuzzy':
+        # Любая общая триграмма делает документ кандидатом, bm25 поднимает наверх
+        # документы с наибольшим числом совпавших триграмм
+        value = " ".join(q.lower().split())
+        trigrams = list(dict.fromkeys(value[i:i + 3] for i in range(len(value) - 2)))
+        if not trigrams:
+            return None
+        return " OR ".join(_quote(trigram) for trigram in trigrams)
+
+    tokens = stem_tokens(q) if mode == 'stemmed' else re.findall(r'\w+', q)
+    if not tokens:
+        return None
+    # Все слова обязательны
+    return " ".join(_quote(token) for token in tokens)
+
+
+def _stemmed_snippets(db: Session, q: str, ids: List[int]) -> Dict[int, str]:
+    """Подсвеченные фрагменты для результатов stemmed-поиска.
+
+    Индекс основ не хранит исходный текст, поэтому фрагмент строится по documents_fts
+    префиксным запросом по основам слов, который совпадает с любыми их формами.
+    """
+    stems = stem_tokens(q)
+    if not stems or not ids:
+        return {}
+
+    match = " OR ".join(_quote(stem) + "*" for stem in stems)
+    id_params = {f'id{i}': doc_id for i, doc_id in enumerate(ids)}
+    rows = db.execute(text(f"""
+        SELECT rowid, snippet(documents_fts, -1, '<b>', '</b>', '...', {SNIPPET_TOKENS})
+        FROM documents_fts
+        WHERE documents_fts MATCH :match AND rowid IN ({", ".join(':' + key for key in id_params)})
+    """), {'match': match, **id_params}).all()
+    return {row[0]: row[1] for row in rows}
+
+
+def encode_cursor(hit: Dict) -> str:
+    """Непрозрачный курсор на позицию после найденного документа: ранг и id"""
+    raw = json.dumps([hit['rank'], hit['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """Разбирает курсор encode_cursor; для некорректного курсора бросает ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, doc_id = json.loads(raw)
+        return float(rank), int(doc_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+def encode_continuation(q: str, doc_type: Optional[str], pending: List[Dict]) -> str:
+    """Непрозрачный токен продолжения поиска на сайте: запрос и недообойденные типы"""
+    state = {'q': q, 'doc_type': doc_type,
+             'pending': [[item['url'], item['name'], item['skip']] for item in pending]}
+    raw = zlib.compress(json.dumps(state, ensure_ascii=False).encode())
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_continuation(token: str) -> Tuple[str, Optional[str], List[Dict]]:
+    """Разбирает токен encode_continuation; для некорректного токена бросает ValueError"""
+    try:
+        raw = zlib.decompress(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        state = json.loads(raw)
+        pending = [{'url': str(url), 'name': str(name), 'skip': int(skip)}
+                   for url, name, skip in state['pending']]
+        return state['q'], state['doc_type'], pending
+    except (TypeError, ValueError, KeyError, binascii.Error, zlib.error) as e:
+        raise ValueError(f"Некорректный токен продолжения: {token}") from e
+
+
+def _cached_total(key: Tuple) -> Optional[int]:
+    with _totals_lock:
+        entry = _totals.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        _totals.move_to_end(key)
+        return entry[1]
+
+
+def _store_total(key: Tuple, total: int) -> None:
+    with _totals_lock:
+        _totals[key] = (time.monotonic() + TOTAL_CACHE_TTL, total)
+        _totals.move_to_end(key)
+        while len(_totals) > TOTAL_CACHE_SIZE:
+            _totals.popitem(last=False)
+
+
+def _count(db: Session, table: str, source: str, filters: str, params: Dict,
+           exact_total: bool) -> Tuple[int, bool]:
+    """Число совпадений и признак точности.
+
+    Точный подсчет кэшируется на TOTAL_CACHE_TTL секунд. Без exact_total и без
+    значения в кэше совпадения считаются только до ESTIMATE_LIMIT.
+    """
+    key = (table,) + tuple(sorted(params.items()))
+    if not exact_total:
+        total = _cached_total(key)
+        if total is not None:
+            return total, True
+
+    if not filters:
+        source = table
+    limit = "" if exact_total else "LIMIT :estimate_limit"
+    total = db.execute(text(f"""
+        SELECT count(*) FROM (
+            SELECT 1
+            FROM {source}
+            WHERE {table} MATCH :match {filters}
+            {limit}
+        )
+    """), dict(params, estimate_limit=ESTIMATE_LIMIT + 1)).scalar()
+
+    if exact_total or total <= ESTIMATE_LIMIT:
+        _store_total(key, total)
+        return total, True
+    return ESTIMATE_LIMIT, False
+
+
+def _narrow_date_range(db: Session, params: Dict) -> bool:
+    """Попадает ли в диапазон дат не больше DATE_RANGE_SCAN_LIMIT документов (по индексу published_on)"""
+    conditions = [condition for key, condition in (('date_from', "published_on >= :date_from"),
+                                                   ('date_to', "published_on <= :date_to")) if key in params]
+    found = db.execute(text(f"""
+        SELECT count(*) FROM (
+            SELECT 1 FROM documents WHERE {' AND '.join(conditions)} LIMIT :scan_limit
+        )
+    """), dict(params, scan_limit=DATE_RANGE_SCAN_LIMIT + 1)).scalar()
+    return found <= DATE_RANGE_SCAN_LIMIT
+
+
+def search_documents(db: Session, q: str, doc_type: Optional[str] = None,
+                     mode: str = 'exact', limit: int = 10, offset: int = 0,
+                     cursor: Optional[str] = None,
+                     exact_total: bool = False,
+                     date_from: Optional[date] = None, date_to: Optional[date] = None,
+                     number: Optional[str] = None) -> Tuple[List[Dict], int, bool, Optional[str]]:
+    """Ранжированный (bm25) поиск по индексу выбранного режима с подсвеченными фрагментами.
+
+    Страница задается смещением offset или курсором cursor из предыдущего ответа;
+    курсор продолжает выдачу по (rank, id) без пропуска offset строк.
+    date_from, date_to и number отбирают документы по индексированным колонкам
+    published_on и number_key (number приводится к каноническому виду split_number).
+    Возвращает найденные документы страницы, число совпадений, признак его точности
+    и курсор следующей страницы (None, если она пуста).
+    """
+    # Триграммам нужно хотя бы три символа, короткие запросы ищем по словам
+    if mode == 'fuzzy' and len(q.strip()) < 3:
+        mode = 'exact'
+
+    match = build_match_query(q, mode)
+    if match is None:
+        return [], 0, True, None
+
+    table, weights = MODE_INDEXES[mode]
+    if mode in ('stemmed', 'fuzzy'):
+        # Для stemmed фрагменты строятся отдельным запросом ниже, а для fuzzy
+        # подсветка FTS5 некорректно склеивает перекрывающиеся триграммы
+        snippet = "NULL"
+    else:
+        snippet = f"snippet({table}, -1, '<b>', '</b>', '...', {SNIPPET_TOKENS})"
+
+    params = {'match': match}
+    conditions = []
+    if doc_type:
+        conditions.append("d.doc_type LIKE :doc_type")
+        params['doc_type'] = f"%{doc_type}%"
+    if date_from:
+        conditions.append("d.published_on >= :date_from")
+        params['date_from'] = date_from.isoformat()
+    if date_to:
+        conditions.append("d.published_on <= :date_to")
+        params['date_to'] = date_to.isoformat()
+    if number:
+        number_prefix, number_key = split_number(number)
+        if number_key is None:
+            return [], 0, True, None
+        conditions.append("d.number_key = :number_key")
+        params['number_key'] = number_key
+        if number_prefix:
+            conditions.append("d.number_prefix = :number_prefix")
+            params['number_prefix'] = number_prefix
+    filters = "".join(f" AND {condition}" for condition in conditions)
+
+    source = f"{table} JOIN documents d ON d.id = {table}.rowid"
+    if (date_from or date_to) and not number and _narrow_date_range(db, params):
+        # CROSS JOIN закрепляет порядок: сначала документы диапазона, затем MATCH по rowid
+        source = f"documents d CROSS JOIN {table} ON d.id = {table}.rowid"
+
+    page_params = dict(params, limit=limit + 1, offset=offset)
+    after = ""
+    if cursor:
+        page_params['after_rank'], page_params['after_id'] = decode_cursor(cursor)
+        page_params['offset'] = 0
+        after = f"""
+            AND (bm25({table}, {weights}) > :after_rank
+                 OR (bm25({table}, {weights}) = :after_rank AND d.id > :after_id))
+        """
+
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = db.execute(text(f"""
+        SELECT d.id, d.title, d.url, d.doc_type, d.date_published, d.number,
+               d.summary,
+               bm25({table}, {weights}) AS rank,
+               {snippet} AS snippet
+        FROM {source}
+        WHERE {table} MATCH :match {filters} {after}
+        ORDER BY rank, d.id
+        LIMIT :limit OFFSET :offset
+    """), page_params).mappings().all()
+
+    hits = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(hits[-1]) if len(rows) > limit else None
+
+    total, total_exact = _count(db, table, source, filters, params, exact_total)
+    if not cursor:
+        # Оценка не может быть меньше уже увиденного
+        total = max(total, offset + len(rows))
+
+    if mode == 'stemmed':
+        snippets = _stemmed_snippets(db, q, [hit['id'] for hit in hits])
+        for hit in hits:
+            hit['snippet'] = snippets.get(hit['id'])
+
+    return hits, total, total_exact, next_cursor
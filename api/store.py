@@ -0,0 +1,166 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .database import DocumentTypeDB, DocumentDB, DocumentSectionDB
+from .normalize import document_fields
+
+UNKNOWN_TYPE = "Неизвестно"
+
+
+def save_document_types(db: Session, types_data: List[Dict[str, str]]) -> None:
+    """Сохраняет типы документов, которых еще нет в БД"""
+    existing = {name for (name,) in db.query(DocumentTypeDB.name)}
+
+    for type_data in types_data:
+        if type_data['name'] in existing:
+            continue
+        existing.add(type_data['name'])
+        db.add(DocumentTypeDB(
+            name=type_data['name'],
+            url=type_data['url']
+        ))
+
+    db.commit()
+
+
+def replace_document_types(db: Session, types_data: List[Dict[str, str]]) -> None:
+    """Заменяет список типов документов новым"""
+    # Очищаем старые данные
+    db.query(DocumentTypeDB).delete()
+
+    # Добавляем новые
+    for type_data in types_data:
+        db.add(DocumentTypeDB(
+            name=type_data['name'],
+            url=type_data['url']
+        ))
+
+    db.commit()
+
+
+def save_listing(db: Session, doc_type: str, documents_data: List[Dict[str, str]]) -> None:
+    """Сохраняет документы со страницы списка одним запросом INSERT ... ON CONFLICT.
+
+    Новые документы добавляются, у уже сохраненных заполняются недостающие тип,
+    дата и номер. Заголовок не перезаписывается: его изменение переиндексирует текст.
+    """
+    if not documents_data:
+        return
+
+    rows = [
+        {
+            'title': doc_data['title'],
+            'url': doc_data['url'],
+            'doc_type': doc_type,
+            'date_published': doc_data.get('date_published'),
+            'number': doc_data.get('number'),
+            'last_updated': datetime.utcnow(),
+            **document_fields(doc_data['title'], doc_data.get('date_published'), doc_data.get('number')),
+        }
+        for doc_data in documents_data
+    ]
+
+    stmt = insert(DocumentDB).values(rows)
+    current, new = DocumentDB.__table__.c, stmt.excluded
+    # Документ, сохраненный до страницы списка, получает тип "Неизвестно"
+    unknown_type = or_(current.doc_type.is_(None), current.doc_type == UNKNOWN_TYPE)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['url'],
+        set_={
+            'doc_type': case((unknown_type, new.doc_type), else_=current.doc_type),
+            'date_published': func.coalesce(current.date_published, new.date_published),
+            'number': func.coalesce(current.number, new.number),
+            'published_on': func.coalesce(current.published_on, new.published_on),
+            # Обозначение и номер заменяются только вместе
+            'number_prefix': case((current.number_key.is_(None), new.number_prefix), else_=current.number_prefix),
+            'number_key': func.coalesce(current.number_key, new.number_key),
+        },
+        # Строки, которым нечего заполнять, не переписываем
+        where=or_(
+            and_(unknown_type, new.doc_type.isnot(None), new.doc_type != UNKNOWN_TYPE),
+            and_(current.date_published.is_(None), new.date_published.isnot(None)),
+            and_(current.number.is_(None), new.number.isnot(None)),
+            and_(current.published_on.is_(None), new.published_on.isnot(None)),
+            and_(current.number_key.is_(None), new.number_key.isnot(None)),
+        )
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def _apply_document_content(db: Session, db_doc: Optional[DocumentDB], url: str, content_data: Dict) -> DocumentDB:
+    """Обновляет запись документа или создает новую; фиксирует изменения вызывающий"""
+    outline = [
+        DocumentSectionDB(position=position, **section)
+        for position, section in enumerate(content_data.get('outline', []))
+    ]
+    if db_doc:
+        db_doc.content = content_data['content']
+        db_doc.sections = json.dumps(content_data['sections'])
+        db_doc.outline = outline
+        db_doc.last_updated = datetime.utcnow()
+        if not db_doc.title:
+            db_doc.title = content_data['title']
+    else:
+        db_doc = DocumentDB(
+            title=content_data['title'],
+            url=url,
+            doc_type=UNKNOWN_TYPE,
+            content=content_data['content'],
+            sections=json.dumps(content_data['sections']),
+            outline=outline
+        )
+        db.add(db_doc)
+
+    # Документ, которого не было в списках, получает дату и номер из заголовка
+    if db_doc.published_on is None or db_doc.number_key is None:
+        fields = document_fields(db_doc.title, db_doc.date_published, db_doc.number)
+        if db_doc.published_on is None:
+            db_doc.published_on = fields['published_on']
+        if db_doc.number_key is None:
+            db_doc.number_prefix, db_doc.number_key = fields['number_prefix'], fields['number_key']
+    return db_doc
+
+
+def save_document_content(db: Session, url: str, content_data: Dict) -> DocumentDB:
+    """Сохраняет содержимое документа, создавая запись при необходимости"""
+    for attempt in range(2):
+        db_doc = db.query(DocumentDB).filter(DocumentDB.url == url).first()
+
+        # Обновляем или создаем запись в БД
+        db_doc = _apply_document_content(db, db_doc, url, content_data)
+
+        try:
+            db.commit()
+            return db_doc
+        except IntegrityError:
+            # Запись с этим URL успела создать другая сессия - обновляем ее
+            db.rollback()
+            if attempt:
+                raise
+
+
+def save_documents_content(db: Session, documents: Dict[str, Dict]) -> List[DocumentDB]:
+    """Сохраняет содержимое нескольких документов (URL -> данные) одной транзакцией"""
+    for attempt in range(2):
+        existing = {
+            db_doc.url: db_doc
+            for db_doc in db.query(DocumentDB).filter(DocumentDB.url.in_(list(documents)))
+        }
+        saved = [
+            _apply_document_content(db, existing.get(url), url, content_data)
+            for url, content_data in documents.items()
+        ]
+
+        try:
+            db.commit()
+            return saved
+        except IntegrityError:
+            # Часть записей успела создать другая сессия - повторяем с обновлением
+            db.rollback()
+            if attempt:
+                raise
@@ -0,0 +1,72 @@
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+
+class _Snapshot(NamedTuple):
+    expires_at: float
+    types: List[Dict]
+    # (имя в нижнем регистре через casefold, тип) в порядке списка
+    folded: List[tuple]
+    by_folded_name: Dict[str, Dict]
+
+
+class TypeRegistry:
+    """Типы документов в памяти процесса с индексом для поиска по имени без учета регистра.
+
+    Список живет ttl секунд. Устаревший список не отдается get(), но продолжает
+    использоваться resolve() и match(), пока его не заменят: если сайт недоступен,
+    лучше искать по старому списку, чем не искать совсем. Снимок заменяется целиком,
+    поэтому реестр можно читать из нескольких потоков без блокировок.
+    """
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._snapshot: Optional[_Snapshot] = None
+
+    @property
+    def fresh(self) -> bool:
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot.expires_at > time.monotonic()
+
+    def get(self) -> Optional[List[Dict]]:
+        """Актуальный список типов или None, если его нужно загрузить заново"""
+        return list(self._snapshot.types) if self.fresh else None
+
+    def set(self, types_data: List[Dict]) -> None:
+        # Пустой список - признак ошибки загрузки, им нельзя затирать известные типы
+        if not types_data:
+            return
+        types = [dict(type_data) for type_data in types_data]
+        folded = [(type_data['name'].casefold(), type_data) for type_data in types]
+        by_folded_name = {}
+        for name, type_data in folded:
+            by_folded_name.setdefault(name, type_data)
+        self._snapshot = _Snapshot(time.monotonic() + self.ttl, types, folded, by_folded_name)
+
+    def invalidate(self) -> None:
+        self._snapshot = None
+
+    def resolve(self, doc_type: str) -> Optional[Dict]:
+        """Тип по имени: сначала точное совпадение, затем первый тип, имя которого содержит doc_type"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        key = doc_type.casefold()
+        if key in snapshot.by_folded_name:
+            return snapshot.by_folded_name[key]
+        return next((type_data for name, type_data in snapshot.folded if key in name), None)
+
+    def match(self, doc_type: Optional[str] = None) -> List[Dict]:
+        """Все типы, имя которых содержит doc_type; без doc_type - все типы"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        if not doc_type:
+            return list(snapshot.types)
+        key = doc_type.casefold()
+        return [type_data for name, type_data in snapshot.folded if key in name]
+
+
+# Общий реестр процесса: им пользуются оба скрапера и эндпоинты API
+default_type_registry = TypeRegistry(ttl=float(os.getenv("MEGANORM_TYPES_TTL", "3600")))
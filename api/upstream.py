@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+from urllib.parse import urlparse
+from .concurrency import UpstreamError
+
+
+class CircuitOpenError(UpstreamError):
+    """Запрос не отправлен: сайт недавно не отвечал, и предохранитель разомкнут"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"{host}: предохранитель разомкнут, повтор через {retry_in:.0f} с")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Предохранитель для каждого хоста.
+
+    После failure_threshold неудачных загрузок подряд (UpstreamError) размыкается:
+    запросы к хосту сразу завершаются CircuitOpenError, не дожидаясь таймаутов.
+    Раз в reset_timeout секунд один запрос пропускается как пробный; успешный
+    ответ замыкает предохранитель, неудачный оставляет разомкнутым еще на reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        # Для каждого хоста: число неудач подряд, момент размыкания (None - замкнут), счетчики
+        self._hosts: Dict[str, Dict] = {}
+
+    def _host(self, url: str) -> Dict:
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = {'failures': 0, 'opened_at': None, 'opened': 0, 'rejected': 0}
+        return self._hosts[host]
+
+    def before_request(self, url: str) -> None:
+        """Бросает CircuitOpenError, если запрос к хосту сейчас отправлять нельзя"""
+        with self._lock:
+            state = self._host(url)
+            if state['opened_at'] is None:
+                return
+            retry_in = state['opened_at'] + self.reset_timeout - time.monotonic()
+            if retry_in <= 0:
+                # Пробный запрос; следующий пробный - не раньше чем через reset_timeout
+                state['opened_at'] = time.monotonic()
+                return
+            state['rejected'] += 1
+        raise CircuitOpenError(urlparse(url).netloc, retry_in)
+
+    def record_success(self, url: str) -> None:
+        with self._lock:
+            state = self._host(url)
+            state['failures'] = 0
+            state['opened_at'] = None
+
+    def record_failure(self, url: str) -> None:
+        with self._lock:
+            state = self._host(url)
+            state['failures'] += 1
+            if state['opened_at'] is not None:
+                state['opened_at'] = time.monotonic()
+            elif state['failures'] >= self.failure_threshold:
+                state['opened_at'] = time.monotonic()
+                state['opened'] += 1
+
+    def is_open(self, url: str) -> bool:
+        """Разомкнут ли предохранитель хоста и не пора ли пробовать снова"""
+        with self._lock:
+            state = self._host(url)
+            return (state['opened_at'] is not None
+                    and state['opened_at'] + self.reset_timeout > time.monotonic())
+
+    def get_status(self) -> Dict[str, Dict]:
+        """Состояние по хостам: closed, open или half_open (следующий запрос будет пробным)"""
+        now = time.monotonic()
+        with self._lock:
+            status = {}
+            for host, state in self._hosts.items():
+                if state['opened_at'] is None:
+                    name, retry_in = 'closed', 0.0
+                else:
+                    retry_in = max(0.0, state['opened_at'] + self.reset_timeout - now)
+                    name = 'open' if retry_in > 0 else 'half_open'
+                status[host] = {
+                    'state': name,
+                    'consecutive_failures': state['failures'],
+                    'retry_in': round(retry_in, 1),
+                    'times_opened': state['opened'],
+                    'rejected': state['rejected'],
+                }
+            return status
+
+
+# Общий предохранитель процесса: его делят все скраперы, если им не передан свой
+default_breaker = CircuitBreaker()
+
+
+class NegativeCache:
+    """Адреса, по которым недавно не нашлось документа (404 или пустое содержимое).
+
+    Повторные запросы таких адресов в течение ttl секунд отвечаются сразу, без сайта.
+    Хранится не больше max_size адресов, самые старые вытесняются.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+
+    def add(self, url: str) -> None:
+        with self._lock:
+            self._entries[url] = time.monotonic() + self.ttl
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, url: str) -> None:
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(url)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._entries[url]
+                return False
+            self.hits += 1
+            return True
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits}
@@ -0,0 +1,178 @@
+"""Задержка цикла событий при одновременной работе с БД: синхронные запросы прямо
+в корутинах (как было в эндпоинтах) против run_db из api.database.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_event_loop [--documents 100] [--tasks 16] [--operations 40]
+
+tasks корутин выполняют по operations операций вперемешку: поиск по полнотекстовому
+индексу, чтение документа с распаковкой текста и сохранение страницы списка. Рядом
+работает корутина-метроном, которая просыпается каждые --tick-ms мс и записывает,
+на сколько она опоздала; это и есть задержка, которую увидел бы любой другой запрос.
+
+Старый способ работает с отдельной БД без настроек SQLite (журнал DELETE,
+synchronous=FULL), новый - с БД движка api.database (WAL, busy_timeout, NORMAL).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+SEARCH_QUERIES = ('пожарной', 'безопасности', 'эвакуации', 'требования')
+
+
+def make_content(i: int) -> dict:
+    paragraphs = [
+        f'Статья {n}. Требования пожарной безопасности к объекту защиты № {i}. '
+        f'Пути эвакуации должны обеспечивать безопасную эвакуацию людей. ' * 2
+        for n in range(20)
+    ]
+    content = '\n'.join(paragraphs)
+    return {
+        'title': f'Свод правил СП {i}.13130 Системы противопожарной защиты',
+        'content': content,
+        'sections': [],
+        'outline': [{'level': 1, 'heading': '', 'parent': None, 'start': 0, 'end': len(content)}],
+    }
+
+
+def document_url(i: int) -> str:
+    return f'https://meganorm.ru/mega_doc/fire/sp/0/sp_{i}.html'
+
+
+def seed(session_factory, documents: int) -> None:
+    from api.store import save_document_content
+
+    with session_factory() as db:
+        for i in range(documents):
+            save_document_content(db, document_url(i), make_content(i))
+
+
+def search(db, i: int):
+    from api.search import search_documents
+
+    return search_documents(db, SEARCH_QUERIES[i % len(SEARCH_QUERIES)], limit=10)
+
+
+def read_document(db, i: int):
+    from api.database import DocumentDB
+
+    db_doc = db.query(DocumentDB).filter(DocumentDB.url == document_url(i)).first()
+    return db_doc.content
+
+
+def save_page(db, i: int):
+    from api.store import save_listing
+
+    save_listing(db, 'Свод правил', [
+        {
+            'title': f'Свод правил СП {i}.{n} (новая редакция)',
+            'url': f'https://meganorm.ru/mega_doc/fire/sp/1/sp_{i}_{n}.html',
+            'date_published': '01.03.2021',
+            'number': f'СП {i}.{n}',
+        }
+        for n in range(20)
+    ])
+
+
+OPERATIONS = (search, read_document, read_document, save_page)
+
+
+async def ticker(interval: float, lags: list, stop: asyncio.Event) -> None:
+    expected = time.perf_counter() + interval
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, expected - time.perf_counter()))
+        now = time.perf_counter()
+        lags.append(now - expected)
+        expected = now + interval
+
+
+async def workload(call, tasks: int, operations: int, documents: int, interval: float):
+    lags = []
+    stop = asyncio.Event()
+    metronome = asyncio.ensure_future(ticker(interval, lags, stop))
+
+    async def worker(worker_no: int):
+        for n in range(operations):
+            i = worker_no * operations + n
+            await call(OPERATIONS[i % len(OPERATIONS)], i % documents)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(worker_no) for worker_no in range(tasks)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await metronome
+    return lags, tasks * operations / elapsed
+
+
+def legacy_call(session_factory):
+    async def call(func, i):
+        # Запрос выполняется прямо в цикле событий; остальные корутины ждут его окончания
+        with session_factory() as db:
+            func(db, i)
+        await asyncio.sleep(0)
+    return call
+
+
+async def run_db_call(func, i):
+    from api.database import run_db
+
+    await run_db(func, i)
+
+
+def legacy_sessions(url: str):
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from api.database import Base, _migrate_documents
+    from api.search import create_search_index, register_sql_functions
+
+    engine = create_engine(url)
+    event.listen(engine, "connect", register_sql_functions)
+    Base.metadata.create_all(bind=engine)
+    _migrate_documents(engine)
+    create_search_index(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def summary(lags: list) -> tuple:
+    ordered = sorted(lags)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return statistics.median(ordered) * 1000, p99 * 1000, ordered[-1] * 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--tasks', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=40)
+    parser.add_argument('--tick-ms', type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='meganorm-bench-')
+    os.environ['MEGANORM_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    from api.database import DB_THREADS, SessionLocal, create_tables
+    create_tables()
+    legacy = legacy_sessions(f"sqlite:///{os.path.join(workdir, 'legacy.db')}")
+
+    results = {}
+    for name, session_factory, call in (
+            ('on loop', legacy, legacy_call(legacy)),
+            (f'run_db x{DB_THREADS}', SessionLocal, run_db_call)):
+        seed(session_factory, args.documents)
+        results[name] = asyncio.run(
+            workload(call, args.tasks, args.operations, args.documents, args.tick_ms / 1000)
+        )
+
+    print(f"{args.tasks} задач по {args.operations} операций, {args.documents} документов, "
+          f"метроном {args.tick_ms:g} мс")
+    print(f"{'':12} {'lag p50, ms':>12} {'lag p99, ms':>12} {'lag max, ms':>12} {'ops/s':>10}")
+    for name, (lags, throughput) in results.items():
+        p50, p99, worst = summary(lags)
+        print(f"{name:12} {p50:>12.2f} {p99:>12.2f} {worst:>12.2f} {throughput:>10.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
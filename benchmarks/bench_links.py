@@ -0,0 +1,64 @@
+"""Сравнение разбора ссылок страниц типов и списков: полное дерево BeautifulSoup
+(html.parser) против api.links.extract_links.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_links [--rounds 20] [файлы.html ...]
+
+Без аргументов используются страница типов и страница списка из фикстур
+(benchmarks/fixtures.py).
+Для каждой страницы проверяется, что оба способа дают одинаковый результат.
+"""
+import argparse
+import statistics
+import sys
+import time
+from bs4 import BeautifulSoup
+from api.links import extract_links
+from .fixtures import load_page, is_recorded
+
+
+def legacy_links(content: bytes):
+    soup = BeautifulSoup(content, 'html.parser')
+    return [(link.get('href'), link.get_text(strip=True)) for link in soup.find_all('a', href=True)]
+
+
+def measure(func, content: bytes, rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(content)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', help='HTML-файлы для сравнения')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.pages:
+        pages = [(path, open(path, 'rb').read()) for path in args.pages]
+    else:
+        pages = [
+            (f"{'recorded' if is_recorded(kind) else 'synthetic'} {kind} page", load_page(kind))
+            for kind in ('types', 'listing')
+        ]
+
+    failed = False
+    print(f"{'page':40} {'links':>6} {'html.parser, ms':>16} {'extract_links, ms':>18} {'speedup':>8}")
+    for name, content in pages:
+        expected = legacy_links(content)
+        same = extract_links(content) == expected
+        failed = failed or not same
+
+        legacy = measure(legacy_links, content, args.rounds)
+        fast = measure(extract_links, content, args.rounds)
+        print(f"{name[-40:]:40} {len(expected):>6} {legacy * 1000:>16.2f} {fast * 1000:>18.2f} "
+              f"{legacy / fast:>7.1f}x{'' if same else '  RESULTS DIFFER'}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Сохранение страницы списка в БД: построчная проверка и вставка (N+1 запрос)
+против одного INSERT ... ON CONFLICT из api.store.save_listing.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_listing [--documents 100] [--rounds 20]
+
+Замеряются два случая: страница с новыми документами (все строки вставляются)
+и повторное сохранение той же страницы (все документы уже есть в БД).
+Для каждого способа проверяется, что в БД оказываются одинаковые строки.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def legacy_save_listing(db, doc_type, documents_data):
+    from sqlalchemy.exc import IntegrityError
+    from api.database import DocumentDB
+
+    for doc_data in documents_data:
+        db_doc = db.query(DocumentDB).filter(DocumentDB.url == doc_data['url']).first()
+        if not db_doc:
+            db.add(DocumentDB(
+                title=doc_data['title'],
+                url=doc_data['url'],
+                doc_type=doc_type,
+                date_published=doc_data.get('date_published'),
+                number=doc_data.get('number')
+            ))
+
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+
+def make_page(documents: int, round_no: int):
+    return [
+        {
+            'title': f'Федеральный закон от 22.07.2008 № {i}-ФЗ "Технический регламент о требованиях '
+                     f'пожарной безопасности" (ред. {round_no})',
+            'url': f'https://meganorm.ru/mega_doc/fire/zakon/0/doc_{round_no}_{i}.html',
+            'date_published': '22.07.2008',
+            'number': f'{i}-ФЗ',
+        }
+        for i in range(documents)
+    ]
+
+
+def measure(save, documents: int, rounds: int):
+    from api.database import SessionLocal
+
+    inserted, repeated = [], []
+    for round_no in range(rounds):
+        page = make_page(documents, round_no)
+        for timings in (inserted, repeated):
+            with SessionLocal() as db:
+                start = time.perf_counter()
+                save(db, 'Федеральный закон', page)
+                timings.append(time.perf_counter() - start)
+    return statistics.median(inserted), statistics.median(repeated)
+
+
+def stored_rows():
+    from api.database import SessionLocal, DocumentDB
+
+    with SessionLocal() as db:
+        return db.query(
+            DocumentDB.title, DocumentDB.url, DocumentDB.doc_type, DocumentDB.date_published, DocumentDB.number
+        ).order_by(DocumentDB.url).all()
+
+
+def clear():
+    from api.database import SessionLocal, DocumentDB
+
+    with SessionLocal() as db:
+        db.query(DocumentDB).delete()
+        db.commit()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='meganorm-bench-')
+    os.environ['MEGANORM_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    from api.database import create_tables
+    from api.store import save_listing
+    create_tables()
+
+    results = {}
+    for name, save in (('N+1', legacy_save_listing), ('ON CONFLICT', save_listing)):
+        clear()
+        results[name] = measure(save, args.documents, args.rounds) + (stored_rows(),)
+
+    same = results['N+1'][2] == results['ON CONFLICT'][2]
+    print(f"{args.documents} документов на странице, медиана из {args.rounds} повторов")
+    print(f"{'':12} {'new page, ms':>14} {'repeated page, ms':>18}")
+    for name, (inserted, repeated, _) in results.items():
+        print(f"{name:12} {inserted * 1000:>14.2f} {repeated * 1000:>18.2f}")
+    legacy, fast = results['N+1'], results['ON CONFLICT']
+    print(f"{'speedup':12} {legacy[0] / fast[0]:>13.1f}x {legacy[1] / fast[1]:>17.1f}x"
+          f"{'' if same else '  RESULTS DIFFER'}")
+
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
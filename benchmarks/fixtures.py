@@ -0,0 +1,84 @@
+"""HTML-фикстуры страниц meganorm.ru для бенчмарков.
+
+Записанные страницы лежат в benchmarks/fixtures/ (types.html, listing.html, document.html)
+и обновляются командой `python -m benchmarks.record`. Если какой-то страницы нет,
+используется детерминированная синтетическая страница той же структуры.
+"""
+import os
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGE_KINDS = ('types', 'listing', 'document')
+
+
+def make_types_page(types: int = 40) -> bytes:
+    menu = ''.join(f'<li><a href="/mega_doc/fire/menu_{i}.html">Раздел {i}</a></li>' for i in range(60))
+    rows = ''.join(
+        f'<tr><td><a href="/mega_doc/fire/type_{i}/type_{i}_0.html">Федеральный закон, группа {i}</a></td>'
+        f'<td>{i * 17}</td></tr>'
+        for i in range(types)
+    )
+    return (
+        f'<html><head><meta charset="windows-1251"><title>Пожарная безопасность</title>'
+        f'<script>var counter = 1;</script></head><body><ul id="menu">{menu}</ul>'
+        f'<table>{rows}</table><a href="/mega_doc/fire/fire.html#top">Наверх</a></body></html>'
+    ).encode('windows-1251')
+
+
+def make_listing_page(documents: int = 300) -> bytes:
+    rows = ''.join(
+        f'<tr><td><a href="/mega_doc/fire/zakon/0/doc_{i}.html">Федеральный закон от 22.07.2008 '
+        f'№ {i}-ФЗ &quot;Технический регламент о требованиях пожарной безопасности&quot; '
+        f'<!-- ред. --><b>(ред. {i})</b></a></td><td><div class="note">Действует, '
+        f'<span>документ {i}</span></div></td></tr>'
+        for i in range(documents)
+    )
+    pages = ''.join(f'<a href="/mega_doc/fire/zakon/zakon_{p}.html">{p}</a>' for p in range(20))
+    return (
+        f'<html><head><meta charset="windows-1251"><title>Список</title></head><body>'
+        f'<div class="pages">{pages}</div><table>{rows}</table></body></html>'
+    ).encode('windows-1251')
+
+
+def make_document_page(chapters: int = 40, articles: int = 12, paragraphs: int = 6) -> bytes:
+    body = []
+    for chapter in range(1, chapters + 1):
+        body.append(f'<h2>Глава {chapter}. Требования пожарной безопасности к объектам защиты</h2>')
+        for article in range(1, articles + 1):
+            body.append(f'<h3>Статья {chapter}.{article}. Общие положения</h3>')
+            for paragraph in range(1, paragraphs + 1):
+                body.append(
+                    f'<p>{paragraph}. Системы противопожарной защиты объекта должны обеспечивать '
+                    f'безопасность людей и сохранность имущества в соответствии с пунктом '
+                    f'{chapter}.{article}.{paragraph} настоящего Федерального закона.</p>'
+                )
+    return (
+        '<html><head><meta charset="windows-1251"><title>Федеральный закон № 123-ФЗ</title>'
+        '<style>p { margin: 0 }</style></head><body><div id="menu"><a href="/">Главная</a></div>'
+        '<h1>Федеральный закон от 22.07.2008 № 123-ФЗ "Технический регламент о требованиях '
+        'пожарной безопасности"</h1><div class="content">' + ''.join(body) +
+        '<script>counter();</script></div></body></html>'
+    ).encode('windows-1251')
+
+
+GENERATORS = {
+    'types': make_types_page,
+    'listing': make_listing_page,
+    'document': make_document_page,
+}
+
+
+def recorded_path(kind: str) -> str:
+    return os.path.join(FIXTURES_DIR, f'{kind}.html')
+
+
+def load_page(kind: str) -> bytes:
+    """Записанная страница указанного вида или синтетическая, если записи нет"""
+    path = recorded_path(kind)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return GENERATORS[kind]()
+
+
+def is_recorded(kind: str) -> bool:
+    return os.path.exists(recorded_path(kind))
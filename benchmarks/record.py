@@ -0,0 +1,48 @@
+"""Записывает настоящие страницы meganorm.ru в benchmarks/fixtures/.
+
+Запуск из корня репозитория (нужен доступ к сайту):
+    python -m benchmarks.record [--type-index 0] [--document-index 0]
+
+Сохраняются страница типов, первая страница списка выбранного типа
+и выбранный документ из этого списка.
+"""
+import argparse
+import os
+import sys
+import requests
+from api.scraper import MeganormScraper
+from .fixtures import FIXTURES_DIR, recorded_path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--type-index', type=int, default=0)
+    parser.add_argument('--document-index', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    # Без кэша: записываем то, что сайт отдает сейчас
+    os.environ['MEGANORM_HTTP_CACHE'] = ''
+    scraper = MeganormScraper()
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+
+    def record(kind: str, url: str) -> bytes:
+        response = scraper.session.get(url, timeout=30)
+        response.raise_for_status()
+        with open(recorded_path(kind), 'wb') as f:
+            f.write(response.content)
+        print(f"{kind}: {url} ({len(response.content)} байт)")
+        return response.content
+
+    try:
+        types = scraper._parse_document_types(record('types', scraper.types_url))
+        type_url = scraper.listing_url(types[args.type_index]['url'], 0)
+        documents = scraper._parse_documents(record('listing', type_url), 0)
+        record('document', documents[args.document_index]['url'])
+    except (requests.RequestException, IndexError) as e:
+        print(f"Не удалось записать фикстуры: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Офлайн-бенчмарки скраперов и API на фикстурах meganorm.ru.
+
+Страницы отдает локальный сервер-заглушка (benchmarks/server.py), база данных
+создается во временном каталоге, HTTP-кэш отключен.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run [--iterations 30] [--latency-ms 0] [--only подстрока]
+                             [--out results.json] [--compare baseline.json] [--threshold 10]
+
+Результат - JSON с ops/s, p50/p95/p99 (мс) и пиковым RSS процесса (КБ) для каждого
+бенчмарка. С --compare выводится сравнение с сохраненным базовым прогоном; код
+возврата 1, если какой-то бенчмарк стал медленнее больше чем на threshold процентов.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+from .fixtures import PAGE_KINDS, is_recorded
+from .server import StandInServer
+
+SEARCH_QUERY = 'пожарной'
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, Linux - килобайты
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(func: Callable[[int], object], iterations: int, warmup: int = 1) -> Dict:
+    for i in range(warmup):
+        func(-1 - i)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def scraper_benchmarks(base_url: str, loop: asyncio.AbstractEventLoop) -> Dict[str, Callable[[int], object]]:
+    from api.concurrency import HostBudget
+    from api.scraper import MeganormScraper, AsyncMeganormScraper
+    from api.type_registry import TypeRegistry
+
+    # Бюджет вежливости к заглушке не нужен: измеряем загрузку и разбор, а не паузы
+    budget = HostBudget(max_concurrent=64, min_interval=0)
+    types = TypeRegistry()
+    sync_scraper = MeganormScraper(base_url=base_url, budget=budget, types=types)
+    async_scraper = AsyncMeganormScraper(base_url=base_url, budget=budget, types=types)
+    type_url = sync_scraper.get_document_types()[0]['url']
+    document_url = sync_scraper.get_documents_by_type(type_url)[0]['url']
+
+    def run(coro_func):
+        return lambda i: loop.run_until_complete(coro_func(i))
+
+    # Загрузка типов измеряется без реестра, поиск - с реестром, как в API
+    def sync_types(i):
+        types.invalidate()
+        return sync_scraper.get_document_types()
+
+    async def async_types(i):
+        types.invalidate()
+        return await async_scraper.get_document_types()
+
+    return {
+        'scraper.sync.get_document_types': sync_types,
+        'scraper.sync.get_documents_by_type': lambda i: sync_scraper.get_documents_by_type(type_url),
+        'scraper.sync.get_document_content': lambda i: sync_scraper.get_document_content(document_url),
+        'scraper.async.get_document_types': run(async_types),
+        'scraper.async.get_documents_by_type': run(lambda i: async_scraper.get_documents_by_type(type_url)),
+        'scraper.async.get_document_content': run(lambda i: async_scraper.get_document_content(document_url)),
+        'scraper.async.search_documents': run(lambda i: async_scraper.search_documents(SEARCH_QUERY)),
+    }
+
+
+def api_benchmarks(base_url: str, loop: asyncio.AbstractEventLoop) -> Dict[str, Callable[[int], object]]:
+    # Настройки читаются при импорте приложения
+    os.environ['MEGANORM_BASE_URL'] = base_url
+    os.environ['MEGANORM_HOST_MAX_CONCURRENT'] = '64'
+    os.environ['MEGANORM_HOST_MIN_INTERVAL'] = '0'
+    os.environ.pop('MEGANORM_CRAWLER', None)
+    import httpx
+    from api.main import app
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench')
+
+    def get(path_func, **params):
+        async def request(i):
+            response = await client.get(path_func(i), params={
+                key: value(i) if callable(value) else value for key, value in params.items()
+            })
+            response.raise_for_status()
+            return response
+        return lambda i: loop.run_until_complete(request(i))
+
+    # Заполняем БД: типы документов и первая страница списка
+    get(lambda i: '/document-types')(0)
+    doc_type = loop.run_until_complete(client.get('/document-types')).json()[0]['name']
+    documents = loop.run_until_complete(client.get(f'/documents/{doc_type}')).json()
+    stored_url = documents[0]['url']
+    live_url = stored_url.rsplit('.html', 1)[0] + '_live_{}.html'
+
+    return {
+        'api.document_types': get(lambda i: '/document-types'),
+        'api.documents_by_type': get(lambda i: f'/documents/{doc_type}'),
+        'api.document.stored': get(lambda i: '/document', url=stored_url),
+        'api.document.live': get(lambda i: '/document', url=lambda i: live_url.format(i)),
+        'api.search': get(lambda i: '/search', q=SEARCH_QUERY),
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> bool:
+    """Печатает сравнение с базовым прогоном; возвращает True, если есть регрессии"""
+    regressed = False
+    print(f"\n{'benchmark':40} {'ops/s':>10} {'base':>10} {'Δ ops/s':>9} {'p95 ms':>9} {'base':>9} {'Δ p95':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:40} {result['ops_per_sec']:>10.1f} {'-':>10}")
+            continue
+
+        ops_delta = (result['ops_per_sec'] / base['ops_per_sec'] - 1) * 100
+        p95_delta = (result['p95_ms'] / base['p95_ms'] - 1) * 100
+        slower = ops_delta < -threshold or p95_delta > threshold
+        regressed = regressed or slower
+        print(f"{name:40} {result['ops_per_sec']:>10.1f} {base['ops_per_sec']:>10.1f} {ops_delta:>+8.1f}% "
+              f"{result['p95_ms']:>9.2f} {base['p95_ms']:>9.2f} {p95_delta:>+7.1f}%{'  REGRESSION' if slower else ''}")
+    return regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='задержка ответа сервера-заглушки')
+    parser.add_argument('--only', help='запускать только бенчмарки, имя которых содержит подстроку')
+    parser.add_argument('--out', help='файл для результатов в JSON (по умолчанию stdout)')
+    parser.add_argument('--compare', help='JSON базового прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=10.0, help='допустимое ухудшение, %%')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='meganorm-bench-')
+    os.environ['MEGANORM_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['MEGANORM_HTTP_CACHE'] = ''
+
+    loop = asyncio.new_event_loop()
+    results = {}
+    with StandInServer(latency=args.latency_ms / 1000) as server:
+        for factory in (scraper_benchmarks, api_benchmarks):
+            for name, func in factory(server.base_url, loop).items():
+                if args.only and args.only not in name:
+                    continue
+                results[name] = measure(func, args.iterations)
+                print(f"{name:40} {results[name]['ops_per_sec']:>10.1f} ops/s  "
+                      f"p50 {results[name]['p50_ms']:.2f} ms  p95 {results[name]['p95_ms']:.2f} ms",
+                      file=sys.stderr)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'latency_ms': args.latency_ms,
+            'fixtures': {kind: 'recorded' if is_recorded(kind) else 'synthetic' for kind in PAGE_KINDS},
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
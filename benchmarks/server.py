@@ -0,0 +1,75 @@
+"""Локальный HTTP-сервер, подменяющий meganorm.ru в бенчмарках.
+
+Отдает фикстуры по виду адреса: страница типов (.../fire.html), документ
+(путь с /0/) или страница списка (любой другой .html).
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .fixtures import load_page, PAGE_KINDS
+
+
+def page_kind(path: str):
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    if path.endswith('/fire.html'):
+        return 'types'
+    if '/0/' in path:
+        return 'document'
+    if path.endswith('.html'):
+        return 'listing'
+    return None
+
+
+class StandInServer:
+    """Сервер-заглушка в фоновом потоке; latency - задержка ответа в секундах"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.pages = {kind: load_page(kind) for kind in PAGE_KINDS}
+        self.requests = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.requests += 1
+                kind = page_kind(self.path)
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+
+                if kind is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                body = stand_in.pages[kind]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self) -> 'StandInServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,45 +1,72 @@
 import requests
 from bs4 import BeautifulSoup
-from typing import List, Optional
-import re
-import time
+from typing import Iterator, List, Optional
 from urllib.parse import urljoin, urlparse
 from models import Document, DocumentType, ScrapingResult
+from api.http_cache import HttpCache, CachingAdapter
+from api.links import extract_links
+from api.concurrency import HostBudget, PoliteAdapter, default_budget, iter_completed
+from api.type_registry import TypeRegistry, default_type_registry
+from api.normalize import document_number, format_number, published_date
 
 class MeganormScraper:
-    def __init__(self):
-        self.base_url = "https://meganorm.ru"
+    def __init__(self, cache: Optional[HttpCache] = None, budget: HostBudget = default_budget,
+                 search_concurrency: int = 8, base_url: str = "https://meganorm.ru",
+                 types: TypeRegistry = default_type_registry):
+        self.base_url = base_url
+        self.search_concurrency = search_concurrency
+        # Типы документов общие со скраперами API и не загружаются повторно до истечения TTL
+        self.types = types
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
+        
+        # Сетевые запросы соблюдают бюджет вежливости хоста вместо фиксированных пауз
+        adapter = PoliteAdapter(budget)
+        
+        # Дисковый HTTP-кэш под сессией (общий с API-скрапером)
+        self.cache = cache or HttpCache.from_env()
+        if self.cache:
+            adapter = CachingAdapter(self.cache, adapter)
+        
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
-    def get_page(self, url: str) -> Optional[BeautifulSoup]:
-        """Получить и парсить страницу"""
+    def fetch(self, url: str) -> Optional[bytes]:
+        """Получить страницу без разбора"""
         try:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
-            return BeautifulSoup(response.content, 'html.parser')
+            return response.content
         except Exception as e:
             print(f"Ошибка при загрузке {url}: {e}")
             return None
     
+    def get_page(self, url: str) -> Optional[BeautifulSoup]:
+        """Получить и парсить страницу"""
+        content = self.fetch(url)
+        if content is None:
+            return None
+        return BeautifulSoup(content, 'html.parser')
+    
     def get_document_types(self) -> ScrapingResult:
         """Извлечь все типы документов с главной страницы"""
-        main_url = "https://meganorm.ru/mega_doc/fire/fire.html"
-        soup = self.get_page(main_url)
+        cached = self.types.get()
+        if cached is not None:
+            return ScrapingResult(success=True, data=cached, total_count=len(cached))
         
-        if not soup:
+        main_url = urljoin(self.base_url, "/mega_doc/fire/fire.html")
+        content = self.fetch(main_url)
+        
+        if content is None:
             return ScrapingResult(success=False, data=[], error="Не удалось загрузить главную страницу")
         
         document_types = []
         
         try:
-            # Поиск ссылок на типы документов
-            links = soup.find_all('a', href=True)
-            
-            for link in links:
-                href = link.get('href')
+            # Поиск ссылок на типы документов (разбираются только ссылки, без дерева страницы)
+            for href, title in extract_links(content):
                 if not href or not href.startswith('/mega_doc/fire/'):
                     continue
                 
@@ -47,7 +74,6 @@ class MeganormScraper:
                 if href.endswith('fire.html') or '#' in href:
                     continue
                 
-                title = link.get_text(strip=True)
                 if not title or len(title) < 3:
                     continue
                 
@@ -71,6 +97,7 @@ class MeganormScraper:
                     seen_urls.add(doc_type['url'])
                     unique_types.append(doc_type)
             
+            self.types.set(unique_types)
             return ScrapingResult(
                 success=True,
                 data=unique_types,
@@ -82,26 +109,22 @@ class MeganormScraper:
     
     def get_documents_by_type(self, type_url: str, limit: int = 50) -> ScrapingResult:
         """Получить список документов определенного типа"""
-        soup = self.get_page(type_url)
+        content = self.fetch(type_url)
         
-        if not soup:
+        if content is None:
             return ScrapingResult(success=False, data=[], error="Не удалось загрузить страницу типа документов")
         
         documents = []
         
         try:
-            # Поиск ссылок на документы
-            doc_links = soup.find_all('a', href=True)
-            
-            for link in doc_links:
-                href = link.get('href')
+            # Поиск ссылок на документы (разбираются только ссылки, без дерева страницы)
+            for href, title in extract_links(content):
                 if not href or not self._is_document_link(href):
                     continue
                 
                 if len(documents) >= limit:
                     break
                 
-                title = link.get_text(strip=True)
                 if not title:
                     continue
                 
@@ -194,33 +217,42 @@ class MeganormScraper:
         except Exception as e:
             return ScrapingResult(success=False, data=[], error=f"Ошибка извлечения содержимого: {str(e)}")
     
+    def iter_search_documents(self, query: str, doc_types: List[dict], limit: int = 20) -> Iterator[dict]:
+        """Найденные документы по мере загрузки списков типов.
+        
+        Списки загружаются параллельно (не больше search_concurrency одновременно),
+        после limit найденных документов оставшиеся загрузки отменяются.
+        """
+        def search_type(doc_type_info):
+            docs_result = self.get_documents_by_type(doc_type_info['url'], limit=100)
+            if not docs_result.success:
+                return []
+            # Фильтруем по запросу
+            return [doc for doc in docs_result.data if query.lower() in doc['title'].lower()]
+        
+        found = 0
+        results = iter_completed(search_type, doc_types, self.search_concurrency)
+        try:
+            for documents in results:
+                for doc in documents:
+                    yield doc
+                    found += 1
+                    if found >= limit:
+                        return
+        finally:
+            results.close()
+    
     def search_documents(self, query: str, doc_type: str = None, limit: int = 20) -> ScrapingResult:
         """Поиск документов по ключевому слову"""
         try:
-            # Сначала получаем все типы документов
+            # Сначала получаем все типы документов (из реестра, пока он свежий)
             types_result = self.get_document_types()
-            if not types_result.success:
+            # Пока сайт недоступен, ищем по известному, пусть и устаревшему, списку типов
+            if not types_result.success and not self.types.match():
                 return types_result
             
-            all_documents = []
-            
-            for doc_type_info in types_result.data:
-                if doc_type and doc_type.lower() not in doc_type_info['name'].lower():
-                    continue
-                
-                docs_result = self.get_documents_by_type(doc_type_info['url'], limit=100)
-                if docs_result.success:
-                    # Фильтруем по запросу
-                    for doc in docs_result.data:
-                        if query.lower() in doc['title'].lower():
-                            all_documents.append(doc)
-                            if len(all_documents) >= limit:
-                                break
-                
-                if len(all_documents) >= limit:
-                    break
-                
-                time.sleep(0.5)  # Задержка между запросами
+            doc_types = self.types.match(doc_type)
+            all_documents = list(self.iter_search_documents(query, doc_types, limit))
             
             return ScrapingResult(
                 success=True,
@@ -256,14 +288,10 @@ class MeganormScraper:
                 'zakon' in href or 'gost' in href or 'postanovlen' in href)
     
     def _extract_date_and_number(self, title: str) -> tuple:
-        """Извлечь дату и номер из названия документа"""
-        date_pattern = r'(\d{1,2}[./]\d{1,2}[./]\d{4})'
-        number_pattern = r'№?\s*(\d+[\w\-]*)'
-        
-        date_match = re.search(date_pattern, title)
-        number_match = re.search(number_pattern, title)
-        
-        date = date_match.group(1) if date_match else None
-        number = number_match.group(1) if number_match else None
+        """Извлечь дату и номер из названия документа (разбор api.normalize, как у API):
+        дата ДД.ММ.ГГГГ, номер с обозначением - 'ГОСТ Р 53325-2012', '123-ФЗ'"""
+        published_on = published_date(None, title)
+        date = published_on.strftime('%d.%m.%Y') if published_on else None
+        number = format_number(*document_number(None, title))
         
         return date, number
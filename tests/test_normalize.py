@@ -0,0 +1,101 @@
+from datetime import date
+
+import pytest
+
+from api.normalize import document_fields, format_number, parse_date, split_number
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('22.07.2008', date(2008, 7, 22)),
+    ('22_07_2008', date(2008, 7, 22)),
+    ('1/3/2021', date(2021, 3, 1)),
+    ('2008-07-22', date(2008, 7, 22)),
+    ('22 июля 2008 г.', date(2008, 7, 22)),
+    ('1 Марта 2021', date(2021, 3, 1)),
+    ('от 22.07.2008 № 123-ФЗ', date(2008, 7, 22)),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+@pytest.mark.parametrize('value', [None, '', 'без даты', '31.02.2020', '22 июлю 2008'])
+def test_parse_date_invalid(value):
+    assert parse_date(value) is None
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('ГОСТ Р 53325-2012', ('ГОСТ Р', '53325-2012')),
+    ('гост р исо 9001-2015', ('ГОСТ Р ИСО', '9001-2015')),
+    ('ГОСТ  12.1.004-91', ('ГОСТ', '12.1.004-91')),
+    ('СП 1.13130.2020', ('СП', '1.13130.2020')),
+    ('ТР ТС 043/2017', ('ТР ТС', '043/2017')),
+    ('СанПиН 2.2.4.548-96', ('СанПиН', '2.2.4.548-96')),
+    ('123-фз', ('ФЗ', '123')),
+    ('№ 123–ФЗ', ('ФЗ', '123')),
+    ('N 390-П', ('П', '390')),
+    ('№ 645', (None, '645')),
+    ('645.', (None, '645')),
+    ('53325 - 2012', (None, '53325-2012')),
+    ('Приказ МЧС 645', (None, '645')),
+    ('Приказ МЧС России № 645 от 01.01.2020', (None, '645')),
+])
+def test_split_number(value, expected):
+    assert split_number(value) == expected
+
+
+@pytest.mark.parametrize('value', [None, '', '   '])
+def test_split_number_empty(value):
+    assert split_number(value) == (None, None)
+
+
+@pytest.mark.parametrize('value', ['ГОСТ Р 53325-2012', '123-ФЗ', '645', 'СП 1.13130.2020'])
+def test_format_number_round_trip(value):
+    assert format_number(*split_number(value)) == value
+
+
+def test_document_fields_from_listing():
+    assert document_fields('Технический регламент', '22.07.2008', '123-ФЗ') == {
+        'published_on': date(2008, 7, 22),
+        'number_prefix': 'ФЗ',
+        'number_key': '123',
+    }
+
+
+def test_document_fields_from_title():
+    title = 'Федеральный закон от 22 июля 2008 г. № 123‑ФЗ Технический регламент'
+    assert document_fields(title, None, None) == {
+        'published_on': date(2008, 7, 22),
+        'number_prefix': 'ФЗ',
+        'number_key': '123',
+    }
+
+
+@pytest.mark.parametrize('title, expected', [
+    ('Постановление Правительства РФ 25.04.2012 N 390 О противопожарном режиме',
+     {'published_on': date(2012, 4, 25), 'number_prefix': None, 'number_key': '390'}),
+    ('Федеральный закон 123-ФЗ Технический регламент о требованиях пожарной безопасности',
+     {'published_on': None, 'number_prefix': 'ФЗ', 'number_key': '123'}),
+])
+def test_document_fields_from_title_without_ot_or_sign(title, expected):
+    assert document_fields(title, None, None) == expected
+
+
+def test_document_fields_designation_in_title():
+    assert document_fields('ГОСТ Р 53325-2012 Техника пожарная', None, None) == {
+        'published_on': None,
+        'number_prefix': 'ГОСТ Р',
+        'number_key': '53325-2012',
+    }
+
+
+def test_document_fields_listing_wins_over_title():
+    fields = document_fields('Приказ от 01.01.2000 № 1', '12.03.2020', 'Приказ МЧС 151')
+    assert fields == {'published_on': date(2020, 3, 12), 'number_prefix': None, 'number_key': '151'}
+
+
+def test_document_fields_unknown():
+    assert document_fields('Свод правил', None, None) == {
+        'published_on': None,
+        'number_prefix': None,
+        'number_key': None,
+    }